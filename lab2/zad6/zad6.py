@@ -4,7 +4,8 @@ from abc import ABC, abstractmethod
 import ast
 import string
 import re
-import copy
+import functools
+from contextlib import contextmanager
 
 
 class Subject(ABC):
@@ -17,95 +18,242 @@ class Subject(ABC):
     def detach(self, observer: Observer):
         pass
 
-    @abstractmethod
-    def notify(self):
-        pass
-
 
 class Observer(ABC):
-
-    @abstractmethod
-    def update(self, subject: Subject):
-        pass
+    # observers are not updated by their subjects, Sheet recalculates them in dependency order
+    pass
 
 
 class Sheet():
     
-    def __init__(self, x, y):
-        self._cells = [[Cell('0') for j in range(y)] for i in range(x)]
+    def __init__(self, x, y, sparse=False):
+        # a sparse sheet keeps its cells by (row, column) and creates them only when they are first
+        # written or referenced
+        self._rows = x
+        self._columns = y
+        self._sparse = sparse
+        if sparse:
+            self._cells = {}
+        else:
+            self._cells = [[Cell('0') for j in range(y)] for i in range(x)]
+        # positions of a sparse sheet's cells in row order, sorted again only after cells are added
+        self._order = None
         self._observers = []
+        self._journal = None
+        self._created = None
 
     @staticmethod
     def _calculate_position(ref):
         row = int(re.findall(r'[1-9][0-9]*', ref)[0]) - 1
-        letters = list(reversed(re.findall(r'[A-Z]', ref)))
-        column = string.ascii_uppercase.index(letters[0])
-        for i, letter in enumerate(letters):
-            if i == 0:
-                continue
-            column += (string.ascii_uppercase.index(letter) + 1) * i * len(string.ascii_uppercase)
-        return [row, column]
+        column = 0
+        for letter in re.findall(r'[A-Z]', ref):
+            column = column * len(string.ascii_uppercase) + string.ascii_uppercase.index(letter) + 1
+        return [row, column - 1]
+
+    @staticmethod
+    def _column_name(column):
+        name = ''
+        column += 1
+        while column:
+            column, letter = divmod(column - 1, len(string.ascii_uppercase))
+            name = string.ascii_uppercase[letter] + name
+        return name
 
     def cell(self, ref):
         row, column = Sheet._calculate_position(ref)
-        return self._cells[row][column]
+        return self._cell_at(row, column)
+
+    def _cell_at(self, row, column):
+        if not (0 <= row < self._rows and 0 <= column < self._columns):
+            raise IndexError('Cell {}{} is outside the sheet'.format(Sheet._column_name(column), row + 1))
+        if not self._sparse:
+            return self._cells[row][column]
+        cell = self._cells.get((row, column))
+        if cell is None:
+            cell = self._cells[(row, column)] = Cell('0')
+            self._order = None
+            if self._created is not None:
+                self._created.append((row, column))
+        return cell
+
+    def cells(self):
+        # (row, column) and cell of every existing cell, row by row
+        if not self._sparse:
+            for row, cells in enumerate(self._cells):
+                for column, cell in enumerate(cells):
+                    yield (row, column), cell
+            return
+        if self._order is None:
+            self._order = sorted(self._cells)
+        for position in self._order:
+            yield position, self._cells[position]
+
+    def __iter__(self):
+        return self.cells()
 
     def set(self, ref, content):
-        backup_cells = copy.deepcopy(self._cells)
-        backup_observers = copy.deepcopy(self._observers)
-
+        with self.transaction():
+            try:
+                cell = self.cell(ref)
+                refs = [self.cell(reference) for reference in re.findall(r'[A-Z]+[1-9][0-9]*', content)]
+            except:
+                raise RuntimeError('Error detected, restoring from backup')
+
+            # cycles are found before anything is changed
+            if self._creates_cycle(cell, refs):
+                raise RuntimeError('Circular reference, {} would depend on itself'.format(ref))
+
+            try:
+                self._touch(cell)
+                for ref in self.getrefs(cell):
+                    self._touch(self.cell(ref))
+                    self.cell(ref).detach(cell)
+
+                cell.exp = content
+
+                for ref in self.getrefs(cell):
+                    self._touch(self.cell(ref))
+                    self.cell(ref).attach(cell)
+
+                self.recalculate(cell)
+
+            except:
+                raise RuntimeError('Error detected, restoring from backup')
+
+    @contextmanager
+    def transaction(self):
+        # every cell is journaled before its first change, if anything fails the touched cells
+        # are put back as they were and the cells created meanwhile are removed; a transaction
+        # started inside another one is a savepoint that rolls back only its own changes and
+        # hands its journal over to the outer one when it succeeds
+        outer = (self._journal, self._created)
+        self._journal = {}
+        self._created = []
         try:
-            row, column = Sheet._calculate_position(ref)
-
-            for ref in self.getrefs(self._cells[row][column]):
-                self.cell(ref).detach(self._cells[row][column])
-
-            self._cells[row][column].exp = content
-
-            for ref in self.getrefs(self._cells[row][column]):
-                self.cell(ref).attach(self._cells[row][column])
-
-            self.evaluate(self._cells[row][column])
-        
-        except:
-
-            self._cells = backup_cells
-            self._observers = backup_observers
-            raise RuntimeError('Error detected, restoring from backup')
+            yield self
+        except BaseException:
+            for cell, state in self._journal.values():
+                cell.restore(state)
+            for position in self._created:
+                del self._cells[position]
+            if self._created:
+                self._order = None
+            raise
+        else:
+            if outer[0] is not None:
+                for key, entry in self._journal.items():
+                    outer[0].setdefault(key, entry)
+                outer[1].extend(self._created)
+        finally:
+            self._journal, self._created = outer
+
+    def _touch(self, cell):
+        if self._journal is not None and id(cell) not in self._journal:
+            self._journal[id(cell)] = (cell, cell.save())
 
     def getrefs(self, cell):
-        return re.findall(r'[A-Z]+[1-9][0-9]*', cell.exp)
+        return cell.refs()
+
+    def _creates_cycle(self, cell, refs):
+        # cell's observers are the cells depending on it, a cycle appears if one of the new
+        # referenced cells is cell itself or already depends on it
+        targets = {id(reference) for reference in refs}
+        stack = [cell]
+        seen = set()
+        while stack:
+            current = stack.pop()
+            if id(current) in targets:
+                return True
+            if id(current) not in seen:
+                seen.add(id(current))
+                stack.extend(current.observers())
+        return False
+
+    def _topological_order(self, cell):
+        # cell and every cell depending on it, each after all of its references (Kahn's algorithm)
+        affected = [cell]
+        indegree = {id(cell): 0}
+        for current in affected:
+            for observer in current.observers():
+                if id(observer) not in indegree:
+                    indegree[id(observer)] = 0
+                    affected.append(observer)
+                indegree[id(observer)] += 1
+        order = []
+        ready = [cell]
+        while ready:
+            current = ready.pop()
+            order.append(current)
+            for observer in current.observers():
+                indegree[id(observer)] -= 1
+                if indegree[id(observer)] == 0:
+                    ready.append(observer)
+        return order
+
+    def recalculate(self, cell):
+        # every affected cell is evaluated exactly once, after the cells it references
+        for current in self._topological_order(cell):
+            self.evaluate(current)
 
     def evaluate(self, cell):
+        self._touch(cell)
         vars = {}
         refs = {}
         for ref in self.getrefs(cell):
             vars[ref] = self.cell(ref).value
             refs[ref] = self.cell(ref)
-        cell.value = Sheet.eval_expression(cell.exp, variables=vars)
+        cell.value = cell.function()(vars)
         cell.variables = vars
         cell.ref = refs
-        cell.notify()
         return cell.value
 
     @staticmethod
-    def eval_expression(exp, variables={}):
-        def _eval(node):
+    def compile_expression(exp):
+        # parses exp once and turns it into a python function of the variables dict
+        constants = []
+
+        def _source(node):
+            # a chain of sums is left associative, so only a sum on the right needs parentheses and
+            # long formulas stay as flat as they were written
+            terms = []
+            while isinstance(node, ast.BinOp):
+                right = _source(node.right)
+                terms.append('({})'.format(right) if isinstance(node.right, ast.BinOp) else right)
+                node = node.left
             if isinstance(node, ast.Num):
-                return node.n
+                constants.append(node.n)
+                terms.append('constants[{}]'.format(len(constants) - 1))
             elif isinstance(node, ast.Name):
-                return variables[node.id]
-            elif isinstance(node, ast.BinOp):
-                return _eval(node.left) + _eval(node.right)
+                terms.append('variables[{!r}]'.format(node.id))
             else:
                 raise Exception('Unsupported type {}'.format(node))
+            return ' + '.join(reversed(terms))
 
         node = ast.parse(exp, mode='eval')
-        return _eval(node.body)
+        return eval(compile('lambda variables: ' + _source(node.body), '<cell>', 'eval'), {'constants': constants})
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _cached_expression(exp):
+        return Sheet.compile_expression(exp)
+
+    @staticmethod
+    def eval_expression(exp, variables={}):
+        return Sheet._cached_expression(exp)(variables)
 
     def print(self):
-        print('\n'.join([''.join(['{:6}'.format(item.value) for item in row]) 
-            for row in self._cells]))
+        if not self._sparse:
+            print('\n'.join([''.join(['{:6}'.format(item.value) for item in row])
+                for row in self._cells]))
+            return
+        # only rows and columns holding at least one cell are shown, labeled since some are skipped
+        rows = sorted({row for row, column in self._cells})
+        columns = sorted({column for row, column in self._cells})
+        lines = [' ' * 6 + ''.join(['{:>6}'.format(Sheet._column_name(column)) for column in columns])]
+        for row in rows:
+            lines.append('{:>6}'.format(row + 1) + ''.join(['{:6}'.format(self._cells[(row, column)].value)
+                if (row, column) in self._cells else ' ' * 6 for column in columns]))
+        print('\n'.join(lines))
 
 
 class Cell(Observer, Subject):
@@ -117,15 +265,40 @@ class Cell(Observer, Subject):
         self.ref = {}
         self.variables = {}
 
-    def update(self, subject):
-        # find ref of updated subject
-        for reference, cell_object in self.ref.items():
-            if cell_object == subject:
-                # update value
-                self.variables[reference] = subject.value
-        # reevaluate expression
-        self.value = Sheet.eval_expression(self.exp, variables=self.variables)
-        self.notify()
+    @property
+    def exp(self):
+        return self._exp
+
+    @exp.setter
+    def exp(self, exp):
+        # compiled function and references are worked out again only after the expression changes
+        self._exp = exp
+        self._function = None
+        self._refs = None
+
+    def function(self):
+        if self._function is None:
+            self._function = Sheet.compile_expression(self._exp)
+        return self._function
+
+    def refs(self):
+        if self._refs is None:
+            self._refs = re.findall(r'[A-Z]+[1-9][0-9]*', self._exp)
+        return self._refs
+
+    def observers(self):
+        return self._observers
+
+    def save(self):
+        state = dict(self.__dict__)
+        state['_observers'] = list(self._observers)
+        state['variables'] = dict(self.variables)
+        state['ref'] = dict(self.ref)
+        return state
+
+    def restore(self, state):
+        self.__dict__.clear()
+        self.__dict__.update(state)
 
     def attach(self, observer):
         self._observers.append(observer)
@@ -133,10 +306,6 @@ class Cell(Observer, Subject):
     def detach(self, observer):
         self._observers.remove(observer)
 
-    def notify(self):
-        for observer in self._observers:
-            observer.update(self)
-
 
 if __name__=="__main__":
     s=Sheet(5,5)
@@ -160,3 +329,10 @@ if __name__=="__main__":
 
     s.print()
     print()
+
+    # formulas with hundreds of terms
+    s=Sheet(400,1,sparse=True)
+    for row in range(1,400):
+        s.set('A{}'.format(row),'1')
+    s.set('A400','+'.join(['A{}'.format(row) for row in range(1,400)]))
+    print("Sum of 399 cells:",s.cell('A400').value)
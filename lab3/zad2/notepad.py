@@ -1,9 +1,24 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+import itertools
+import mmap
+import multiprocessing
 import os
+import queue
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 import tkinter as tk
 import tkinter.filedialog
+import tkinter.font
 import tkinter.messagebox
+import tkinter.simpledialog
 import importlib.util
 
 class SingletonMeta(type):
@@ -30,6 +45,82 @@ class Plugin(ABC):
     def execute(self, *args):
         pass
 
+    # A plugin may also define run(text), which gets a snapshot of the document as one string and
+    # returns (edits, message). edits are (start, end, replacement) offsets into that snapshot.
+    # Such plugins are run in a separate process by PluginJob instead of calling execute.
+
+
+def _load_plugin(path):
+    spec = importlib.util.spec_from_file_location("module.name", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, os.path.split(path)[-1].replace('.py', ''))()
+
+
+def _run_plugin(path, connection, results):
+    try:
+        text = connection.recv()
+        connection.close()
+        edits, message = _load_plugin(path).run(text)
+        results.put(('done', [tuple(edit) for edit in edits or ()], message))
+    except Exception as error:
+        results.put(('error', '{}: {}'.format(type(error).__name__, error), None))
+
+
+class PluginJob:
+    # Runs a plugin's run(text) in its own process over a snapshot of the buffer, so a slow plugin
+    # can't freeze the editor and can be cancelled or stopped after a timeout. The snapshot is
+    # joined into one string and sent to the process by a thread, not on the Tk thread.
+
+    def __init__(self, path, text, timeout):
+        self.text = text
+        self.version = text.version
+        self._snapshot = text.copy()
+        context = multiprocessing.get_context('spawn')
+        self._results = context.Queue()
+        self._receiver, self._sender = context.Pipe(duplex=False)
+        self._process = context.Process(target=_run_plugin, args=(path, self._receiver, self._results), daemon=True)
+        self._deadline = time.monotonic() + timeout
+        self.result = None
+
+    def start(self):
+        self._process.start()
+        # Only the process reads the text, once it is gone sending fails instead of blocking
+        self._receiver.close()
+        threading.Thread(target=self._send, daemon=True).start()
+
+    def _send(self):
+        try:
+            self._sender.send(self._snapshot.substring(0, self._snapshot.length()))
+        except (OSError, ValueError):
+            # The process was stopped before it read the text
+            pass
+        finally:
+            self._sender.close()
+
+    def poll(self):
+        # None while running, then ('done', edits, message), ('error', message, None) or ('timeout', None, None)
+        if self.result is not None:
+            return self.result
+        # Checked before reading, a process that already exited has flushed its result into the queue
+        alive = self._process.is_alive()
+        try:
+            self.result = self._results.get_nowait()
+        except queue.Empty:
+            if not alive:
+                self.result = ('error', 'plugin process exited with code {}'.format(self._process.exitcode), None)
+            elif time.monotonic() > self._deadline:
+                self.cancel()
+                self.result = ('timeout', None, None)
+            return self.result
+        self._process.join()
+        return self.result
+
+    def cancel(self):
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+
 
 class CursorSubject(ABC):
 
@@ -64,14 +155,14 @@ class TextSubject(ABC):
         pass
 
     @abstractmethod
-    def text_notify(self):
+    def text_notify(self, line=None, column=0):
         pass
 
 
 class TextObserver(ABC):
 
     @abstractmethod
-    def updateText(self):
+    def updateText(self, line=None, column=0):
         pass
 
 
@@ -130,31 +221,94 @@ class Action(ABC):
         pass
 
 
-class EditAction():
-    def __init__(self, restore_command, command, past_state, args):
-        self.restore_command = restore_command
-        self.past_state = past_state
-        self.command = command
-        self.args = args
-    
+class EditAction(Action):
+    # Replacing `removed` with `inserted` at `offset`; undo applies the inverse replacement
+
+    _OVERHEAD = 64
+
+    def __init__(self, model, offset, removed, inserted, cursor_before, cursor_after, selection_before, mergeable=False):
+        self.model = model
+        self.offset = offset
+        self.removed = removed
+        self.inserted = inserted
+        self.cursor_before = cursor_before
+        self.cursor_after = cursor_after
+        self.selection_before = selection_before
+        self.mergeable = mergeable
+
     def execute_do(self):
-        if self.args is not None:
-            self.command(self.args)
+        self.model.applyEdit(self.offset, self.removed, self.inserted, self.cursor_after, None)
+
+    def execute_undo(self):
+        self.model.applyEdit(self.offset, self.inserted, self.removed, self.cursor_before, self.selection_before)
+
+    def size(self):
+        return len(self.removed) + len(self.inserted) + self._OVERHEAD
+
+    def merge(self, other):
+        if not (self.mergeable and other.mergeable):
+            return False
+        # Typing
+        if not self.removed and not other.removed and other.offset == self.offset + len(self.inserted):
+            self.inserted += other.inserted
+        # Backspace
+        elif not self.inserted and not other.inserted and other.offset + len(other.removed) == self.offset:
+            self.offset = other.offset
+            self.removed = other.removed + self.removed
+        # Delete
+        elif not self.inserted and not other.inserted and other.offset == self.offset:
+            self.removed += other.removed
         else:
-            self.command()
+            return False
+        self.cursor_after = other.cursor_after
+        return True
+
+
+class BatchEditAction(Action):
+    # Several replacements undone and redone as one step. edits are (offset, removed, inserted)
+    # sorted by descending offset, so applying one never moves the offsets of the ones after it.
+    # Undo uses the offsets the replacements ended up at once the lower ones were applied.
+
+    mergeable = False
+
+    def __init__(self, model, edits, cursor_before, cursor_after, selection_before):
+        self.model = model
+        self.edits = edits
+        self.cursor_before = cursor_before
+        self.cursor_after = cursor_after
+        self.selection_before = selection_before
+        self.undo_edits = []
+        shift = 0
+        for offset, removed, inserted in reversed(edits):
+            self.undo_edits.append((offset + shift, inserted, removed))
+            shift += len(inserted) - len(removed)
+        self.undo_edits.reverse()
+
+    def execute_do(self):
+        self.model.applyEdits(self.edits, self.cursor_after, None)
 
     def execute_undo(self):
-        self.restore_command(self.past_state)
+        self.model.applyEdits(self.undo_edits, self.cursor_before, self.selection_before)
+
+    def size(self):
+        return 2 * sum(len(removed) + len(inserted) for _, removed, inserted in self.edits) + EditAction._OVERHEAD * len(self.edits)
+
+    def merge(self, other):
+        return False
 
 
 class UndoManager(UndoStackSubject):
 
     __metaclass__ = SingletonMeta
 
-    def __init__(self):
-        self.undo_stack = []
-        self.redo_stack = []
+    def __init__(self, maxMemory=16 * 1024 * 1024):
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+        self.maxMemory = maxMemory
+        self._memory = 0
         self._undo_observers = []
+        self._batchDepth = 0
+        self._batchPending = False
     
     def empty_undo(self):
         if len(self.undo_stack):
@@ -181,16 +335,49 @@ class UndoManager(UndoStackSubject):
         self.undo_notify()
     
     def push(self, editAction):
+        for action in self.redo_stack:
+            self._memory -= action.size()
+        self.redo_stack.clear()
+        if not self.empty_undo():
+            last = self.undo_stack[-1]
+            size = last.size()
+            if last.merge(editAction):
+                self._memory += last.size() - size
+                self._trim()
+                self.undo_notify()
+                return
         self.undo_stack.append(editAction)
+        self._memory += editAction.size()
+        self._trim()
         self.undo_notify()
 
+    def _trim(self):
+        # Forget the oldest steps once history grows past maxMemory, always keeping the latest one
+        while self.maxMemory is not None and self._memory > self.maxMemory and len(self.undo_stack) > 1:
+            self._memory -= self.undo_stack.popleft().size()
+
     def undo_attach(self, observer):
         self._undo_observers.append(observer)
 
     def undo_detach(self, observer):
         self._undo_observers.remove(observer)
 
+    @contextmanager
+    def batch(self):
+        # Observers hear about changes made inside the outermost batch once, when it ends
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+            if self._batchDepth == 0 and self._batchPending:
+                self._batchPending = False
+                self.undo_notify()
+
     def undo_notify(self):
+        if self._batchDepth:
+            self._batchPending = True
+            return
         for o in self._undo_observers:
             o.updateUndo()
         
@@ -247,21 +434,627 @@ class ClipboardStack(ClipboardSubject):
             o.updateClipboard()
 
 
+class _Piece:
+
+    __slots__ = ('left', 'right', 'priority', 'text', 'start', 'length', 'newlines', 'totalLength', 'totalNewlines')
+
+    def __init__(self, left, right, priority, text, start, length, newlines):
+        self.left = left
+        self.right = right
+        self.priority = priority
+        self.text = text
+        self.start = start
+        self.length = length
+        self.newlines = newlines
+        self.totalLength = length
+        self.totalNewlines = newlines
+        if left is not None:
+            self.totalLength += left.totalLength
+            self.totalNewlines += left.totalNewlines
+        if right is not None:
+            self.totalLength += right.totalLength
+            self.totalNewlines += right.totalNewlines
+
+    def withChildren(self, left, right):
+        return _Piece(left, right, self.priority, self.text, self.start, self.length, self.newlines)
+
+
+class TextBuffer:
+    # Pieces of immutable text kept in a persistent treap ordered by position. Nodes are never
+    # modified, so edits copy only the O(log n) path they touch and copy() is O(1).
+
+    _CHUNK = 2048
+
+    def __init__(self, text=''):
+        self._root = TextBuffer._build(text)
+        # Bumped on every change so observers holding derived data can tell they missed one
+        self.version = 0
+
+    @staticmethod
+    def _fromRoot(root):
+        buffer = TextBuffer()
+        buffer._root = root
+        return buffer
+
+    @staticmethod
+    def _build(text):
+        # Cartesian tree over fixed-size chunks with random priorities
+        pieces = []
+        for start in range(0, len(text), TextBuffer._CHUNK):
+            length = min(TextBuffer._CHUNK, len(text) - start)
+            pieces.append((text, start, length, text.count('\n', start, start + length)))
+        return TextBuffer._buildPieces(pieces)
+
+    @staticmethod
+    def _buildPieces(pieces):
+        stack = []
+        for text, start, length, newlines in pieces:
+            node = _Piece(None, None, random.random(), text, start, length, newlines)
+            last = None
+            while stack and stack[-1].priority < node.priority:
+                last = stack.pop()
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+        if not stack:
+            return None
+        root = stack[0]
+        TextBuffer._recompute(root)
+        return root
+
+    @staticmethod
+    def _recompute(node):
+        node.totalLength = node.length
+        node.totalNewlines = node.newlines
+        for child in (node.left, node.right):
+            if child is not None:
+                TextBuffer._recompute(child)
+                node.totalLength += child.totalLength
+                node.totalNewlines += child.totalNewlines
+
+    @staticmethod
+    def _split(node, offset):
+        if node is None:
+            return None, None
+        left_length = node.left.totalLength if node.left is not None else 0
+        if offset <= left_length:
+            left, right = TextBuffer._split(node.left, offset)
+            return left, node.withChildren(right, node.right)
+        offset -= left_length
+        if offset >= node.length:
+            left, right = TextBuffer._split(node.right, offset - node.length)
+            return node.withChildren(node.left, left), right
+        newlines = node.text.count('\n', node.start, node.start + offset)
+        left = _Piece(node.left, None, node.priority, node.text, node.start, offset, newlines)
+        right = _Piece(None, node.right, node.priority, node.text, node.start + offset,
+                       node.length - offset, node.newlines - newlines)
+        return left, right
+
+    @staticmethod
+    def _merge(left, right):
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            return left.withChildren(left.left, TextBuffer._merge(left.right, right))
+        return right.withChildren(TextBuffer._merge(left, right.left), right.right)
+
+    @staticmethod
+    def _concat(left, right):
+        # Join the pieces meeting at the seam when they are small, so repeated edits at one
+        # position don't fragment the text into single characters
+        if left is None or right is None:
+            return TextBuffer._merge(left, right)
+        last = left
+        while last.right is not None:
+            last = last.right
+        first = right
+        while first.left is not None:
+            first = first.left
+        if last.length + first.length > TextBuffer._CHUNK:
+            return TextBuffer._merge(left, right)
+        left, _ = TextBuffer._split(left, left.totalLength - last.length)
+        _, right = TextBuffer._split(right, first.length)
+        text = last.text[last.start:last.start + last.length] + first.text[first.start:first.start + first.length]
+        return TextBuffer._merge(TextBuffer._merge(left, TextBuffer._build(text)), right)
+
+    @staticmethod
+    def _spans(node, start, end):
+        # (text, start, end) of every piece overlapping [start, end), without slicing the text
+        if node is None or start >= end:
+            return
+        left_length = node.left.totalLength if node.left is not None else 0
+        if start < left_length:
+            yield from TextBuffer._spans(node.left, start, min(end, left_length))
+        piece_start = max(start - left_length, 0)
+        piece_end = min(end - left_length, node.length)
+        if piece_start < piece_end:
+            yield node.text, node.start + piece_start, node.start + piece_end
+        right_start = left_length + node.length
+        if end > right_start:
+            yield from TextBuffer._spans(node.right, max(start - right_start, 0), end - right_start)
+
+    @staticmethod
+    def _fragments(node, start, end):
+        for text, piece_start, piece_end in TextBuffer._spans(node, start, end):
+            yield text[piece_start:piece_end]
+
+    def _newlineOffset(self, k):
+        # Offset of the k-th newline, counting from 1
+        node = self._root
+        base = 0
+        while node is not None:
+            left_newlines = node.left.totalNewlines if node.left is not None else 0
+            if k <= left_newlines:
+                node = node.left
+                continue
+            k -= left_newlines
+            base += node.left.totalLength if node.left is not None else 0
+            if k <= node.newlines:
+                position = node.start - 1
+                for _ in range(k):
+                    position = node.text.find('\n', position + 1)
+                return base + position - node.start
+            k -= node.newlines
+            base += node.length
+            node = node.right
+        raise IndexError('line index out of range')
+
+    def _newlinesBefore(self, offset):
+        node = self._root
+        count = 0
+        while node is not None:
+            left_length = node.left.totalLength if node.left is not None else 0
+            if offset < left_length:
+                node = node.left
+                continue
+            if node.left is not None:
+                count += node.left.totalNewlines
+            offset -= left_length
+            if offset <= node.length:
+                return count + node.text.count('\n', node.start, node.start + offset)
+            count += node.newlines
+            offset -= node.length
+            node = node.right
+        return count
+
+    def _lineIndex(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('line index out of range')
+        return index
+
+    def __len__(self):
+        return (self._root.totalNewlines if self._root is not None else 0) + 1
+
+    def length(self):
+        return self._root.totalLength if self._root is not None else 0
+
+    def lineStart(self, index):
+        return 0 if index == 0 else self._newlineOffset(index) + 1
+
+    def lineEnd(self, index):
+        return self.length() if index == len(self) - 1 else self._newlineOffset(index + 1)
+
+    def offset(self, x, y):
+        return self.lineStart(y) + x
+
+    def position(self, offset):
+        y = self._newlinesBefore(offset)
+        return offset - self.lineStart(y), y
+
+    def substring(self, start, end):
+        return ''.join(TextBuffer._fragments(self._root, start, end))
+
+    def fragments(self, start=0, end=None):
+        return TextBuffer._fragments(self._root, start, self.length() if end is None else end)
+
+    def spans(self, start=0, end=None):
+        return TextBuffer._spans(self._root, start, self.length() if end is None else end)
+
+    def iterLines(self, start=0, stop=None):
+        if stop is None:
+            stop = len(self)
+        if start >= stop:
+            return
+        root = self._root
+        remaining = stop - start
+        pending = []
+        for fragment in TextBuffer._fragments(root, self.lineStart(start), self.length()):
+            parts = fragment.split('\n')
+            pending.append(parts[0])
+            for part in parts[1:]:
+                yield ''.join(pending)
+                remaining -= 1
+                if remaining == 0:
+                    return
+                pending = [part]
+        yield ''.join(pending)
+
+    def __iter__(self):
+        return self.iterLines()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            return list(self.iterLines(start, stop))
+        index = self._lineIndex(index)
+        return self.substring(self.lineStart(index), self.lineEnd(index))
+
+    def __setitem__(self, index, line):
+        index = self._lineIndex(index)
+        start = self.lineStart(index)
+        self.deleteText(start, self.lineEnd(index))
+        self.insertText(start, line)
+
+    def index(self, line):
+        for i, candidate in enumerate(self):
+            if candidate == line:
+                return i
+        raise ValueError('{!r} is not in buffer'.format(line))
+
+    def insertText(self, offset, text):
+        if text:
+            left, right = TextBuffer._split(self._root, offset)
+            self._root = TextBuffer._concat(TextBuffer._concat(left, TextBuffer._build(text)), right)
+            self.version += 1
+
+    def deleteText(self, start, end):
+        if start < end:
+            left, right = TextBuffer._split(self._root, start)
+            _, right = TextBuffer._split(right, end - start)
+            self._root = TextBuffer._concat(left, right)
+            self.version += 1
+
+    def append(self, pieces):
+        # pieces are (text, start, length, newlines) tuples, text may be any object with str slicing, count and find
+        self._root = TextBuffer._merge(self._root, TextBuffer._buildPieces(pieces))
+        self.version += 1
+
+    def copy(self):
+        return TextBuffer._fromRoot(self._root)
+
+
+class _MappedChunk:
+    # Stands in for the str of a piece backed by a MappedFile, decoding it on first use.
+    # A plain chunk is ASCII without carriage returns, so its characters and bytes line up. An exact
+    # chunk's bytes are what saving its text with the file's newline would write.
+
+    __slots__ = ('source', 'start', 'end', 'length', 'plain', 'exact')
+
+    def __init__(self, source, start, end, length=None, plain=False, exact=False):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.length = length
+        self.plain = plain
+        self.exact = exact
+
+    def _text(self):
+        return self.source.decode(self.start, self.end)
+
+    def raw(self, start, end):
+        # Original bytes of characters [start, end) when they can be copied without decoding
+        if not self.exact:
+            return None
+        if self.plain:
+            return self.source.raw(self.start + start, self.start + end)
+        if start == 0 and end == self.length:
+            return self.source.raw(self.start, self.end)
+        return None
+
+    def __getitem__(self, index):
+        return self._text()[index]
+
+    def count(self, sub, start=None, end=None):
+        return self._text().count(sub, start, end)
+
+    def find(self, sub, start=None, end=None):
+        return self._text().find(sub, start, end)
+
+
+class MappedFile:
+    # Read-only memory map of a file cut into chunks that end on a line boundary, or on a character
+    # boundary inside a very long line. Chunks are decoded only when a piece needs them and the most
+    # recently used ones are kept decoded.
+
+    CHUNK = 64 * 1024
+    CACHE = 64
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        with open(path, 'rb') as inp:
+            self._map = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+        # Lines end the way the first one does, saving writes every newline like that
+        first = self._map.find(b'\n')
+        self.newline = '\r\n' if first > 0 and self._map[first - 1] == 0x0D else '\n'
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._map)
+
+    def close(self):
+        self._map.close()
+        with self._lock:
+            self._cache.clear()
+
+    def raw(self, start, end):
+        return self._map[start:end]
+
+    def decode(self, start, end):
+        with self._lock:
+            text = self._cache.get(start)
+            if text is not None:
+                self._cache.move_to_end(start)
+                return text
+        text = self._map[start:end].decode(self.encoding, errors='replace').replace('\r\n', '\n')
+        with self._lock:
+            self._cache[start] = text
+            if len(self._cache) > self.CACHE:
+                self._cache.popitem(last=False)
+        return text
+
+    def pieces(self, stop=None, position=0):
+        # Yields (text, start, length, newlines) for TextBuffer.append from byte position on, which
+        # must be where an earlier chunk ended, and stops early once stop is set
+        size = len(self._map)
+        while position < size and (stop is None or not stop.is_set()):
+            end = self._chunkEnd(position, size)
+            data = self._map[position:end]
+            if data.isascii() and b'\r' not in data:
+                newlines = data.count(b'\n')
+                exact = self.newline == '\n' or newlines == 0
+                yield _MappedChunk(self, position, end, len(data), True, exact), 0, len(data), newlines
+            else:
+                text = self.decode(position, end)
+                exact = text.replace('\n', self.newline).encode(self.encoding, errors='replace') == data
+                yield _MappedChunk(self, position, end, len(text), False, exact), 0, len(text), text.count('\n')
+            position = end
+
+    def _chunkEnd(self, position, size):
+        # After the first newline past CHUNK bytes. A line running on for another CHUNK bytes is cut
+        # there instead, moved back so it splits neither a UTF-8 character nor a \r\n pair.
+        limit = position + 2 * self.CHUNK
+        end = self._map.find(b'\n', position + self.CHUNK - 1, limit)
+        if end != -1:
+            return end + 1
+        if limit >= size:
+            return size
+        end = limit
+        while end > position + self.CHUNK and (self._map[end] & 0xC0 == 0x80 or self._map[end - 1] == 0x0D):
+            end -= 1
+        return end
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class LineIndex(ABC):
+    # Per-line data derived from a TextBuffer, built on first use and then kept up to date by the
+    # model's edits. A change made behind the model's back shows up as a version mismatch, after
+    # which the index is rebuilt the next time it is used.
+
+    def __init__(self):
+        self._text = None
+        self._version = None
+        self._built = False
+
+    @abstractmethod
+    def _build(self, lines):
+        pass
+
+    @abstractmethod
+    def _replaceLines(self, first, removed, lines):
+        pass
+
+    def _ensure(self, text):
+        if not self._built or text is not self._text or text.version != self._version:
+            self._build(iter(text))
+            self._built = True
+            self._text = text
+            self._version = text.version
+
+    def linesChanged(self, text, first, removed, inserted, version):
+        # Lines [first, first + removed) of the buffer at version became [first, first + inserted)
+        if not self._built:
+            return
+        if text is not self._text or version != self._version:
+            self._built = False
+            return
+        self._replaceLines(first, removed, text.iterLines(first, first + inserted))
+        self._version = text.version
+
+
+class SearchIndex(LineIndex):
+    # Inverted index from lowercased trigrams to the lines containing them. Lines have stable ids,
+    # so inserting or removing lines only shifts the id list while other postings stay valid.
+
+    # Larger documents are searched by scanning instead of holding an index for every line
+    LIMIT = 16 * 1024 * 1024
+
+    def __init__(self):
+        super().__init__()
+        self._ids = []
+        self._grams = {}
+        self._postings = {}
+        self._positions = None
+        self._nextId = 0
+
+    def _add(self, line):
+        lineId = self._nextId
+        self._nextId += 1
+        grams = _trigrams(line.lower())
+        self._grams[lineId] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(lineId)
+        return lineId
+
+    def _remove(self, lineId):
+        for gram in self._grams.pop(lineId):
+            postings = self._postings[gram]
+            postings.discard(lineId)
+            if not postings:
+                del self._postings[gram]
+
+    def _build(self, lines):
+        self._grams = {}
+        self._postings = {}
+        self._ids = [self._add(line) for line in lines]
+        self._positions = None
+
+    def _replaceLines(self, first, removed, lines):
+        for lineId in self._ids[first:first + removed]:
+            self._remove(lineId)
+        lineIds = [self._add(line) for line in lines]
+        self._ids[first:first + removed] = lineIds
+        if removed != len(lineIds):
+            self._positions = None
+        elif self._positions is not None:
+            for y, lineId in enumerate(lineIds, first):
+                self._positions[lineId] = y
+
+    def candidates(self, text, needle):
+        # Sorted positions of the lines that may contain needle, or None when they all might
+        grams = _trigrams(needle.lower())
+        if not grams or text.length() > self.LIMIT:
+            return None
+        self._ensure(text)
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        lineIds = postings[0].intersection(*postings[1:])
+        if self._positions is None:
+            self._positions = {lineId: y for y, lineId in enumerate(self._ids)}
+        return sorted(self._positions[lineId] for lineId in lineIds)
+
+
+class _CountJob:
+    # Counts every line of a snapshot on a worker thread. Edits the model makes in the meantime are
+    # counted as they happen and replayed on top of the result once it is in.
+
+    def __init__(self, text, count):
+        self.text = text
+        self.version = text.version
+        self.journal = []
+        self.counts = None
+        self.done = threading.Event()
+        self._snapshot = text.copy()
+        self._count = count
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        counts = []
+        for line in self._snapshot:
+            if self._stop.is_set():
+                return
+            counts.append(self._count(line))
+        self.counts = counts
+        self.done.set()
+
+    def cancel(self):
+        self._stop.set()
+
+
+class TextStatistics(LineIndex):
+    # Word and letter counts of every line plus their running totals, so after the first count
+    # totals() costs O(1) and an edit only recounts the lines it touched. Full counts run in the
+    # background, totals() returns None until one is in.
+
+    def __init__(self):
+        super().__init__()
+        self._counts = []
+        self._job = None
+        self.words = 0
+        self.letters = 0
+
+    @staticmethod
+    def _count(line):
+        words = line.split()
+        return len(words), sum(len(word) for word in words)
+
+    def _build(self, lines):
+        self._install([self._count(line) for line in lines])
+
+    def _install(self, counts):
+        self._counts = counts
+        self.words = sum(words for words, _ in counts)
+        self.letters = sum(letters for _, letters in counts)
+
+    def _replaceLines(self, first, removed, lines):
+        self._replaceCounts(first, removed, [self._count(line) for line in lines])
+
+    def _replaceCounts(self, first, removed, counts):
+        for words, letters in self._counts[first:first + removed]:
+            self.words -= words
+            self.letters -= letters
+        for words, letters in counts:
+            self.words += words
+            self.letters += letters
+        self._counts[first:first + removed] = counts
+
+    def linesChanged(self, text, first, removed, inserted, version):
+        job = self._job
+        if job is not None and text is job.text and version == job.version:
+            job.journal.append((first, removed, [self._count(line) for line in text.iterLines(first, first + inserted)]))
+            job.version = text.version
+            return
+        super().linesChanged(text, first, removed, inserted, version)
+
+    def cancel(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+
+    def totals(self, text):
+        # (lines, words, letters), or None while the lines are still being counted
+        if not self._built or text is not self._text or text.version != self._version:
+            job = self._job
+            if job is None or text is not job.text or text.version != job.version:
+                if job is not None:
+                    job.cancel()
+                job = self._job = _CountJob(text, self._count)
+            if not job.done.is_set():
+                return None
+            self._job = None
+            self._install(job.counts)
+            for first, removed, counts in job.journal:
+                self._replaceCounts(first, removed, counts)
+            self._built = True
+            self._text = text
+            self._version = text.version
+        return len(text), self.words, self.letters
+
+
 class TextEditorModel(CursorSubject, TextSubject):
 
     def __init__(self, text):
-        self.text = text.split('\n')
+        self.text = TextBuffer(text)
         self.selectionRange = None
         self.cursorLocation = Location(len(self.text[-1]), len(self.text) - 1)
         self.undoManager = UndoManager()
+        self.searchIndex = SearchIndex()
+        self.statistics = TextStatistics()
         self._cursor_observers = []
         self._text_observers = []
+        self._batchDepth = 0
+        self._pendingLines = {}
+        self._pendingText = False
+        self._pendingCursor = False
 
     def allLines(self):
         return iter(self.text)
 
     def linesRange(self, index1, index2):
-        return iter(self.text[index1:index2])
+        start, stop, _ = slice(index1, index2).indices(len(self.text))
+        return self.text.iterLines(start, stop)
 
     def moveCursorLeft(self):
         if self.cursorLocation.x == 0:
@@ -301,45 +1094,70 @@ class TextEditorModel(CursorSubject, TextSubject):
                 self.cursorLocation.x = len(self.text[self.cursorLocation.y])
             self.cursor_notify()
 
-    def restore(self, state):
-        self.cursorLocation = state[0]
-        self.text = state[1]
-        self.selectionRange = state[2]
-        try:
-            self.cursor_notify()
-        except IndexError:
-            pass
+    def _replace(self, offset, removed, inserted, y=None):
+        # Every edit goes through here so the search index can follow the changed lines
+        if y is None:
+            y = self.text.position(offset)[1]
+        version = self.text.version
+        lines = len(self.text)
+        self.text.deleteText(offset, offset + len(removed))
+        self.text.insertText(offset, inserted)
+        inserted_lines = inserted.count('\n') + 1
+        for index in (self.searchIndex, self.statistics):
+            index.linesChanged(self.text, y, inserted_lines + lines - len(self.text), inserted_lines, version)
+
+    def applyEdit(self, offset, removed, inserted, cursor, selectionRange):
+        self._replace(offset, removed, inserted)
+        self.selectionRange = selectionRange
+        if '\n' in removed or '\n' in inserted:
+            self.text_notify()
+        else:
+            column, line = self.text.position(offset)
+            self.text_notify(line, column)
+        self.cursorLocation = Location(cursor[0], cursor[1])
+        self.cursor_notify()
+
+    def applyEdits(self, edits, cursor, selectionRange):
+        for offset, removed, inserted in edits:
+            self._replace(offset, removed, inserted)
+        self.selectionRange = selectionRange
         self.text_notify()
+        self.cursorLocation = Location(cursor[0], cursor[1])
+        self.cursor_notify()
+
+    def _copySelectionRange(self):
+        if self.selectionRange is None:
+            return None
+        return LocationRange(Location(self.selectionRange.location1.x, self.selectionRange.location1.y),
+                             Location(self.selectionRange.location2.x, self.selectionRange.location2.y))
 
+    def _pushEdit(self, offset, removed, inserted, cursor_before, selection_before, mergeable):
+        self.undoManager.push(EditAction(self, offset, removed, inserted, cursor_before,
+                                         (self.cursorLocation.x, self.cursorLocation.y), selection_before, mergeable))
 
     def deleteBefore(self):
         if self.cursorLocation.y != 0 or self.cursorLocation.x != 0:
-            editAction = EditAction(self.restore, self.deleteBefore, 
-            [Location(self.cursorLocation.x, self.cursorLocation.y), self.text.copy(), self.selectionRange], None)
-            self.undoManager.push(editAction)
-            if self.cursorLocation.x != 0:
-                self.text[self.cursorLocation.y] = self.text[self.cursorLocation.y][:self.cursorLocation.x - 1] + \
-                                                   self.text[self.cursorLocation.y][self.cursorLocation.x:]
-            else:
-                self.text[self.cursorLocation.y - 1] =  self.text[self.cursorLocation.y - 1] +  self.text[self.cursorLocation.y]
-                self.text.pop(self.cursorLocation.y)
-            self.text_notify()
-            self.moveCursorLeft()
+            cursor_before = (self.cursorLocation.x, self.cursorLocation.y)
+            selection_before = self._copySelectionRange()
+            offset = self.text.offset(self.cursorLocation.x, self.cursorLocation.y)
+            removed = self.text.substring(offset - 1, offset)
+            self._replace(offset - 1, removed, '', self.cursorLocation.y - 1 if removed == '\n' else self.cursorLocation.y)
+            self.text_notify(None if removed == '\n' else self.cursorLocation.y, self.cursorLocation.x - 1)
+            self.cursorLocation.x, self.cursorLocation.y = self.text.position(offset - 1)
+            self.cursor_notify()
+            self._pushEdit(offset - 1, removed, '', cursor_before, selection_before, removed != '\n')
             
 
     def deleteAfter(self):
         if self.cursorLocation.y != len(self.text) - 1 or self.cursorLocation.x != len(self.text[self.cursorLocation.y]):
-            editAction = EditAction(self.restore, self.deleteAfter, 
-            [Location(self.cursorLocation.x, self.cursorLocation.y), self.text.copy(), self.selectionRange], None)
-            self.undoManager.push(editAction)
-            if self.cursorLocation.x != len(self.text[self.cursorLocation.y]):
-                self.text[self.cursorLocation.y] = self.text[self.cursorLocation.y][:self.cursorLocation.x] + \
-                                                   self.text[self.cursorLocation.y][self.cursorLocation.x + 1:]
-            else:
-                self.text[self.cursorLocation.y]=  self.text[self.cursorLocation.y] +  self.text[self.cursorLocation.y + 1]
-                self.text.pop(self.cursorLocation.y + 1)
-            self.text_notify()
+            cursor_before = (self.cursorLocation.x, self.cursorLocation.y)
+            selection_before = self._copySelectionRange()
+            offset = self.text.offset(self.cursorLocation.x, self.cursorLocation.y)
+            removed = self.text.substring(offset, offset + 1)
+            self._replace(offset, removed, '', self.cursorLocation.y)
+            self.text_notify(None if removed == '\n' else self.cursorLocation.y, self.cursorLocation.x)
             self.cursor_notify()
+            self._pushEdit(offset, removed, '', cursor_before, selection_before, removed != '\n')
 
     def _get_selection_range(self, location_range):
         if location_range.location1.x == location_range.location2.x and location_range.location1.y == location_range.location2.y:
@@ -369,66 +1187,115 @@ class TextEditorModel(CursorSubject, TextSubject):
         if selectionRange is None:
             return ''
         loc_start, loc_end = self._get_selection_range(location_range)
-        if loc_start.y == loc_end.y:
-            return self.text[loc_start.y][loc_start.x:loc_end.x]
-        else:
-            text = ''
-            text += self.text[loc_start.y][loc_start.x:] + '\n'
-            for y in range(loc_start.y + 1, loc_end.y):
-                text += self.text[y] + '\n'
-            text += self.text[loc_end.y][:loc_end.x]
-            return text
+        return self.text.substring(self.text.offset(loc_start.x, loc_start.y), self.text.offset(loc_end.x, loc_end.y))
         
 
     def deleteRange(self, location_range):
+        with self.batch():
+            self._deleteRange(location_range)
 
-        editAction = EditAction(self.restore, self.deleteRange,
-         [Location(self.cursorLocation.x, self.cursorLocation.y), self.text.copy(), self.selectionRange], location_range)
-        self.undoManager.push(editAction)
+    def _deleteRange(self, location_range):
+        cursor_before = (self.cursorLocation.x, self.cursorLocation.y)
+        selection_before = self._copySelectionRange()
         selectionRange = self._get_selection_range(location_range)
         if selectionRange is None:
             return
         loc_start, loc_end = self._get_selection_range(location_range)
-        if loc_start.y < loc_end.y:
-            self.text[loc_start.y] = self.text[loc_start.y][:loc_start.x]
-            removed_rows_counter = 0
-            for i in range(loc_start.y + 1, loc_end.y):
-                self.text.pop(i - removed_rows_counter)
-                removed_rows_counter += 1
-            line = self.text.pop(loc_end.y - removed_rows_counter)
-            self.text[loc_start.y] += line[loc_end.x:]
-        else:
-            self.text[loc_start.y] = self.text[loc_start.y][:loc_start.x] + self.text[loc_end.y][loc_end.x:]
+        start = self.text.offset(loc_start.x, loc_start.y)
+        end = self.text.offset(loc_end.x, loc_end.y)
+        removed = self.text.substring(start, end)
+        self._replace(start, removed, '', loc_start.y)
         self.selectionRange = None
         self.text_notify()
-        self.cursorLocation = loc_start
+        self.cursorLocation = Location(loc_start.x, loc_start.y)
         self.cursor_notify()
+        self._pushEdit(start, removed, '', cursor_before, selection_before, False)
 
     def insert(self, chars):
-        editAction = EditAction(self.restore, self.insert, [Location(self.cursorLocation.x, self.cursorLocation.y), self.text.copy(), self.selectionRange], chars)
-        self.undoManager.push(editAction)
+        cursor_before = (self.cursorLocation.x, self.cursorLocation.y)
+        selection_before = self._copySelectionRange()
         if chars == '\r':
-            index = self.cursorLocation.y
-            line = self.text.pop(index)
-            self.text.insert(index, line[self.cursorLocation.x:])
-            self.text.insert(index, line[:self.cursorLocation.x])
-            self.text_notify()
-            self.cursorLocation.x = 0
-            self.cursorLocation.y = index + 1
-            self.cursor_notify()
-            
-        else:
-            self.text[self.cursorLocation.y] = self.text[self.cursorLocation.y][:self.cursorLocation.x] + \
-                                            chars + self.text[self.cursorLocation.y][self.cursorLocation.x:]
-            if '\n' in self.text[self.cursorLocation.y]:
-                split_text = self.text.pop(self.cursorLocation.y).split('\n')
-                split_text.reverse()
-                for split in split_text:
-                    self.text.insert(self.cursorLocation.y, split)
-            self.text_notify()
-            for _ in chars:
-                self.moveCursorRight()
+            chars = '\n'
+        offset = self.text.offset(self.cursorLocation.x, self.cursorLocation.y)
+        self._replace(offset, '', chars, self.cursorLocation.y)
+        self.text_notify(None if '\n' in chars else self.cursorLocation.y, self.cursorLocation.x)
+        self.cursorLocation.x, self.cursorLocation.y = self.text.position(offset + len(chars))
+        self.cursor_notify()
+        if chars:
+            self._pushEdit(offset, '', chars, cursor_before, selection_before, len(chars) == 1 and chars != '\n')
         
+    def _matches(self, pattern, regex=False, ignoreCase=False, first=0, stop=None):
+        # Yields (offset, match) for non-empty matches in lines [first, stop). Literal patterns only
+        # look at the lines the search index reports; a literal spanning lines is searched as a whole.
+        compiled = re.compile(pattern if regex else re.escape(pattern), re.IGNORECASE if ignoreCase else 0)
+        if stop is None:
+            stop = len(self.text)
+        if not regex and '\n' in pattern:
+            start = self.text.lineStart(first)
+            end = self.text.lineEnd(stop - 1)
+            for match in compiled.finditer(self.text.substring(start, end)):
+                yield start, match
+            return
+        candidates = None if regex else self.searchIndex.candidates(self.text, pattern)
+        if candidates is None:
+            lines = enumerate(self.text.iterLines(first, stop), first)
+        else:
+            lines = ((y, self.text[y]) for y in candidates[bisect_left(candidates, first):bisect_left(candidates, stop)])
+        for y, line in lines:
+            start = None
+            for match in compiled.finditer(line):
+                if match.end() > match.start():
+                    if start is None:
+                        start = self.text.lineStart(y)
+                    yield start, match
+
+    def find(self, pattern, regex=False, ignoreCase=False, location=None):
+        # Next match at or after location (the cursor by default), wrapping around the end
+        if not pattern:
+            return None
+        if location is None:
+            location = self.cursorLocation
+        offset = self.text.offset(location.x, location.y)
+        for first, stop, wrapped in ((location.y, None, False), (0, location.y + 1, True)):
+            for start, match in self._matches(pattern, regex, ignoreCase, first, stop):
+                if wrapped or start + match.start() >= offset:
+                    return LocationRange(Location(*self.text.position(start + match.start())),
+                                         Location(*self.text.position(start + match.end())))
+        return None
+
+    def replaceAll(self, pattern, replacement, regex=False, ignoreCase=False):
+        # All replacements are one undo step, returns how many were made
+        if not pattern:
+            return 0
+        edits = [(start + match.start(), match.group(), match.expand(replacement) if regex else replacement)
+                 for start, match in self._matches(pattern, regex, ignoreCase)]
+        if not edits:
+            return 0
+        edits.reverse()
+        self._pushBatch(edits)
+        return len(edits)
+
+    def applyEditScript(self, script):
+        # script is (start, end, replacement) over the current text, applied as one undo step
+        edits = []
+        previous = self.text.length()
+        for start, end, replacement in sorted(script, reverse=True):
+            if not 0 <= start <= end <= previous:
+                raise ValueError('edit script has overlapping or out of range edits')
+            edits.append((start, self.text.substring(start, end), replacement))
+            previous = start
+        if edits:
+            self._pushBatch(edits)
+        return len(edits)
+
+    def _pushBatch(self, edits):
+        cursor_before = (self.cursorLocation.x, self.cursorLocation.y)
+        cursor_after = self.text.position(edits[-1][0])
+        selection_before = self._copySelectionRange()
+        with self.batch():
+            self.applyEdits(edits, cursor_after, None)
+            self.undoManager.push(BatchEditAction(self, edits, cursor_before, cursor_after, selection_before))
+
     def getSelectionRange(self):
         return self.selectionRange
 
@@ -442,7 +1309,35 @@ class TextEditorModel(CursorSubject, TextSubject):
     def cursor_detach(self, observer):
         self._cursor_observers.remove(observer)
 
+    @contextmanager
+    def batch(self):
+        # Groups the edits and cursor moves of one logical operation: observers get at most one
+        # text, cursor and undo notification each when the outermost batch ends
+        self._batchDepth += 1
+        try:
+            with self.undoManager.batch():
+                yield self
+        finally:
+            self._batchDepth -= 1
+            if self._batchDepth == 0:
+                self._flushNotifications()
+
+    def _flushNotifications(self):
+        lines = self._pendingLines
+        text, cursor = self._pendingText, self._pendingCursor
+        self._pendingLines = {}
+        self._pendingText = self._pendingCursor = False
+        if text or len(lines) > 1:
+            self.text_notify()
+        elif lines:
+            self.text_notify(*lines.popitem())
+        if cursor:
+            self.cursor_notify()
+
     def cursor_notify(self):
+        if self._batchDepth:
+            self._pendingCursor = True
+            return
         for o in self._cursor_observers:
             o.updateCursorLocation(self.cursorLocation)
 
@@ -452,13 +1347,153 @@ class TextEditorModel(CursorSubject, TextSubject):
     def text_detach(self, observer):
         self._text_observers.remove(observer)
 
-    def text_notify(self):
+    def text_notify(self, line=None, column=0):
+        # line is set when only that line changed, from column on, and the number of lines stayed the same
+        if self._batchDepth:
+            if line is None:
+                self._pendingText = True
+            else:
+                self._pendingLines[line] = min(column, self._pendingLines.get(line, column))
+            return
         for o in self._text_observers:
-            o.updateText()
+            o.updateText(line, column)
+
+
+class SaveJob:
+    # Writes a snapshot of the buffer on a worker thread into a temporary file next to the target,
+    # fsyncs it and renames it over the target, so a failed save never leaves a half written file.
+    # Pieces still backed by a mapped file are copied as raw bytes without decoding. tail is
+    # (mappedFile, position) while the file is still being indexed, the part from position on is
+    # not in the buffer yet and is read from the map after it. Every line is ended with newline.
+    # source is the saved buffer itself, so the editor can tell whether it still shows that document.
+
+    def __init__(self, text, filepath, encoding='utf-8', tail=None, newline='\n'):
+        self.source = text
+        self.text = text.copy()
+        self.filepath = filepath
+        self.encoding = encoding
+        self.tail = tail
+        self.newline = newline
+        self.total = self.text.length()
+        if tail is not None:
+            self.total += len(tail[0]) - tail[1]
+        self.written = 0
+        self.error = None
+        self.done = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def progress(self):
+        return 100 * self.written // max(1, self.total)
+
+    def _run(self):
+        directory, name = os.path.split(os.path.abspath(self.filepath))
+        temppath = None
+        try:
+            descriptor, temppath = tempfile.mkstemp(prefix='.' + name + '.', suffix='.tmp', dir=directory)
+            with os.fdopen(descriptor, 'wb') as out:
+                spans = self.text.spans()
+                if self.tail is not None:
+                    mappedFile, position = self.tail
+                    spans = itertools.chain(spans, ((chunk, start, start + length)
+                                                    for chunk, start, length, _ in mappedFile.pieces(position=position)))
+                for text, start, end in spans:
+                    data = text.raw(start, end) if isinstance(text, _MappedChunk) else None
+                    if data is None:
+                        data = text[start:end]
+                        if self.newline != '\n':
+                            data = data.replace('\n', self.newline)
+                        data = data.encode(self.encoding)
+                    out.write(data)
+                    self.written += end - start
+                out.flush()
+                os.fsync(out.fileno())
+            if os.path.exists(self.filepath):
+                shutil.copymode(self.filepath, temppath)
+            os.replace(temppath, self.filepath)
+        except (OSError, UnicodeError) as error:
+            self.error = error
+            if temppath is not None and os.path.exists(temppath):
+                os.remove(temppath)
+        finally:
+            self.done.set()
+
+
+class FontMetrics:
+
+    def __init__(self, font):
+        self.font = font
+        self.lineHeight = 20
+        self._widths = {}
+
+    def charWidth(self, char):
+        width = self._widths.get(char)
+        if width is None:
+            width = self._widths[char] = self.font.measure(char)
+        return width
+
+    def width(self, text):
+        return sum(self.charWidth(char) for char in text)
+
+
+class ColumnIndex:
+    # Prefix sums of character widths per line, offsets[y][x] is the pixel offset of column x.
+    # They are extended lazily up to the requested column and cut back at the edited column.
+    # Line lengths come from the buffer's newline offsets, so only the characters being measured are read.
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._offsets = {}
+        self._lengths = {}
+
+    def length(self, text, y):
+        length = self._lengths.get(y)
+        if length is None:
+            length = self._lengths[y] = text.lineEnd(y) - text.lineStart(y)
+        return length
+
+    def offset(self, text, y, x):
+        offsets = self._offsets.get(y)
+        if offsets is None:
+            offsets = self._offsets[y] = [0]
+        x = min(x, self.length(text, y))
+        if len(offsets) <= x:
+            width = offsets[-1]
+            start = text.lineStart(y)
+            for char in text.substring(start + len(offsets) - 1, start + x):
+                width += self.metrics.charWidth(char)
+                offsets.append(width)
+        return offsets[x]
+
+    def lineEnd(self, text, y):
+        return self.offset(text, y, self.length(text, y))
+
+    def lineChanged(self, y, column):
+        offsets = self._offsets.get(y)
+        if offsets is not None:
+            del offsets[column + 1:]
+        self._lengths.pop(y, None)
+
+    def retain(self, first, last):
+        for y in [y for y in self._offsets if y < first or y >= last]:
+            del self._offsets[y]
+        for y in [y for y in self._lengths if y < first or y >= last]:
+            del self._lengths[y]
+
+    def clear(self):
+        self._offsets = {}
+        self._lengths = {}
 
 
 class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoStackObserver):
 
+    MARGIN = 10
+    # Files larger than this are memory mapped and indexed in the background instead of read at once
+    LARGE_FILE = 32 * 1024 * 1024
+    # Seconds an out-of-process plugin may run before it is stopped
+    PLUGIN_TIMEOUT = 30
+
     def __init__(self, textEditorModel, clipboardStack):
         super().__init__()
         self.clipboardStack = clipboardStack
@@ -469,9 +1504,29 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
         self.textEditorModel.undoManager.undo_attach(self)
         self.plugins = {}
         self.filepath = None
-        self.textChars = []
+        self.firstLine = 0
+        self.lineItems = {}
         self.cursor = None
         self.highlight = []
+        self.mappedFile = None
+        self._indexQueue = None
+        self._indexStop = None
+        self._indexThread = None
+        self._indexPoll = None
+        self._indexedEnd = 0
+        self._statistics = None
+        self._statisticsPoll = None
+        self._saveJob = None
+        self._saveQueued = False
+        self._retiredMaps = []
+        self.searchPattern = None
+        self._pluginJob = None
+        self._pluginName = None
+        self._idle = None
+        self._dirtyLines = set()
+        self._dirtyText = False
+        self._dirtyCursor = False
+        self._dirtyUndo = False
         self._initUI()
         self.mainloop()
 
@@ -498,18 +1553,57 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
         self.bind('<Control-V>', self.clipboardAction)
         self.bind('<Control-z>', self.undoAction)
         self.bind('<Control-y>', self.undoAction)
+        self.bind('<Control-f>', lambda event: self.find())
+        self.bind('<F3>', lambda event: self.find_next())
+        self.bind('<Escape>', lambda event: self.cancel_plugin())
         self.frame = tk.Frame(self)
         self.frame.pack(fill=tk.BOTH, expand=1)
         self.canvas = tk.Canvas(self.frame)
         self.canvas.pack(fill=tk.BOTH, expand=1)
+        self.canvas.bind('<Configure>', lambda event: self._show_text())
+        self.canvas.bind('<MouseWheel>', lambda event: self.scroll(-1 if event.delta > 0 else 1))
+        self.canvas.bind('<Button-4>', lambda event: self.scroll(-1))
+        self.canvas.bind('<Button-5>', lambda event: self.scroll(1))
+        self.metrics = FontMetrics(tkinter.font.nametofont('TkDefaultFont'))
+        self.columns = ColumnIndex(self.metrics)
         self._show_text()
         self._draw_cursor(self.textEditorModel.cursorLocation.x, self.textEditorModel.cursorLocation.y)
 
     def initStatusBar(self):
-        self.status_label = tk.Label(self, text="Cursor position: ({}, {}), Number of lines: {}"
-                            .format(self.textEditorModel.cursorLocation.x + 1, self.textEditorModel.cursorLocation.y + 1, len(self.textEditorModel.text)),
-                            borderwidth=2, relief="groove")
+        self.status_label = tk.Label(self, borderwidth=2, relief="groove")
         self.status_label.pack(side=tk.BOTTOM, fill=tk.X)
+        self._update_status()
+
+    def _update_status(self):
+        status = "Cursor position: ({}, {}), Number of lines: {}".format(
+            self.textEditorModel.cursorLocation.x + 1, self.textEditorModel.cursorLocation.y + 1, len(self.textEditorModel.text))
+        if self.mappedFile is None:
+            status += self._statistics_status()
+        if self._indexQueue is not None:
+            status += " (indexing {}%)".format(100 * self._indexedEnd // max(1, len(self.mappedFile)))
+        if self._saveJob is not None:
+            status += " (saving {}%{})".format(self._saveJob.progress(), ", saving again after it" if self._saveQueued else "")
+        if self._pluginJob is not None:
+            status += " (running {}, Esc to cancel)".format(self._pluginName)
+        self.status_label.config(text=status)
+
+    def _statistics_status(self):
+        # Counts only change with the text, a cursor move reuses the last ones
+        text = self.textEditorModel.text
+        if self._statistics is not None and self._statistics[0] is text and self._statistics[1] == text.version:
+            return self._statistics[2]
+        totals = self.textEditorModel.statistics.totals(text)
+        if totals is None:
+            if self._statisticsPoll is None:
+                self._statisticsPoll = self.after(100, self._poll_statistics)
+            return ", Words: counting..."
+        _, words, letters = totals
+        self._statistics = (text, text.version, ", Words: {}, Letters: {}".format(words, letters))
+        return self._statistics[2]
+
+    def _poll_statistics(self):
+        self._statisticsPoll = None
+        self._update_status()
 
     def initToolbar(self):
         # Undo, Redo, Cut, Copy, Paste
@@ -548,6 +1642,16 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
         self.move_menu.add_command(label='Cursor to document start', command=lambda : self.move_cursor('start'))
         self.move_menu.add_command(label='Cursor to document end', command=lambda : self.move_cursor('end'))
         self.menubar.add_cascade(label='Move', menu=self.move_menu)
+        self.search_menu = tk.Menu(self.menubar, tearoff=0)
+        self.search_regex = tk.BooleanVar(self, False)
+        self.search_ignore_case = tk.BooleanVar(self, False)
+        self.search_menu.add_command(label='Find', command=self.find)
+        self.search_menu.add_command(label='Find next', command=self.find_next)
+        self.search_menu.add_command(label='Replace all', command=self.replace_all)
+        self.search_menu.add_separator()
+        self.search_menu.add_checkbutton(label='Regular expression', variable=self.search_regex)
+        self.search_menu.add_checkbutton(label='Ignore case', variable=self.search_ignore_case)
+        self.menubar.add_cascade(label='Search', menu=self.search_menu)
         self.plugin_menu = tk.Menu(self.menubar, tearoff=0)
         self.plugin_menu.add_command(label='Add plugin', command=self.find_plugins)
         self.plugin_menu.add_separator()
@@ -561,14 +1665,56 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
 
         if fl != '':
             plugin = self.load_plugin(fl)
-            self.plugin_menu.add_command(label=plugin.getName(),
-            command=lambda: plugin.execute(self.textEditorModel, self.textEditorModel.undoManager, self.clipboardStack))
+            if hasattr(plugin, 'run'):
+                self.plugin_menu.add_command(label=plugin.getName(), command=lambda: self.run_plugin(fl, plugin))
+            else:
+                self.plugin_menu.add_command(label=plugin.getName(),
+                command=lambda: plugin.execute(self.textEditorModel, self.textEditorModel.undoManager, self.clipboardStack))
 
     def load_plugin(self, fl):
-        spec = importlib.util.spec_from_file_location("module.name", fl)
-        foo = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(foo)
-        return getattr(foo, os.path.split(fl)[-1].replace('.py', ''))()
+        return _load_plugin(fl)
+
+    def run_plugin(self, fl, plugin):
+        if self._pluginJob is not None:
+            tk.messagebox.showinfo(plugin.getName(), "Another plugin is still running.")
+            return
+        self._pluginJob = PluginJob(fl, self.textEditorModel.text, self.PLUGIN_TIMEOUT)
+        self._pluginName = plugin.getName()
+        self._pluginJob.start()
+        self._update_status()
+        self.after(100, self._poll_plugin)
+
+    def cancel_plugin(self):
+        if self._pluginJob is not None:
+            self._pluginJob.cancel()
+            self._pluginJob = None
+            self._update_status()
+
+    def _poll_plugin(self):
+        pluginJob = self._pluginJob
+        if pluginJob is None:
+            return
+        result = pluginJob.poll()
+        if result is None:
+            self.after(100, self._poll_plugin)
+            return
+        self._pluginJob = None
+        self._update_status()
+        status, value, message = result
+        if status == 'timeout':
+            tk.messagebox.showerror(self._pluginName, "Plugin stopped after {} seconds.".format(self.PLUGIN_TIMEOUT))
+        elif status == 'error':
+            tk.messagebox.showerror(self._pluginName, value)
+        elif value and (pluginJob.text is not self.textEditorModel.text or pluginJob.version != pluginJob.text.version):
+            tk.messagebox.showerror(self._pluginName, "The document changed while the plugin was running, its edits were not applied.")
+        else:
+            try:
+                self.textEditorModel.applyEditScript(value)
+            except ValueError as error:
+                tk.messagebox.showerror(self._pluginName, str(error))
+                return
+            if message:
+                tk.messagebox.showinfo(self._pluginName, message)
 
     def _open(self):
         ftypes = [('Text files', '*.txt'), ('All files', '*')]
@@ -576,36 +1722,191 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
         fl = dlg.show()
 
         if fl != '':
-            with open(fl, 'r') as inp:
-                inp_content = inp.read()
-                self.textEditorModel.cursor_detach(self)
-                self.textEditorModel.text_detach(self)
-                self.textEditorModel.undoManager.undo_detach(self)
-                self.clipboardStack.clip_detach(self)
-
-                self.textEditorModel = TextEditorModel(inp_content)
-                self.clipboardStack.clip_attach(self)
-                self.textEditorModel.cursor_attach(self)
-                self.textEditorModel.text_attach(self)
-                self.textEditorModel.undoManager.undo_attach(self)
-                self.filepath = None
-                self.textChars = []
-                self.cursor = None
-                self.highlight = []
-                self._show_text()
-                self._draw_cursor(self.textEditorModel.cursorLocation.x, self.textEditorModel.cursorLocation.y)
+            self._stop_indexing()
+            mappedFile = self.mappedFile
+            if os.path.getsize(fl) > self.LARGE_FILE:
+                self._open_mapped(fl)
+            else:
+                with open(fl, 'r') as inp:
+                    inp_content = inp.read()
+                    self._set_model(TextEditorModel(inp_content))
+                    self.mappedFile = None
+            self._release_mapped(mappedFile)
+
+    def _set_model(self, textEditorModel):
+        self.textEditorModel.cursor_detach(self)
+        self.textEditorModel.text_detach(self)
+        self.textEditorModel.undoManager.undo_detach(self)
+        self.clipboardStack.clip_detach(self)
+        self.textEditorModel.statistics.cancel()
+
+        self.textEditorModel = textEditorModel
+        self.clipboardStack.clip_attach(self)
+        self.textEditorModel.cursor_attach(self)
+        self.textEditorModel.text_attach(self)
+        self.textEditorModel.undoManager.undo_attach(self)
+        self.filepath = None
+        self.firstLine = 0
+        self.lineItems = {}
+        self.columns.clear()
+        self.cursor = None
+        self.highlight = []
+        self._show_text()
+        self._draw_cursor(self.textEditorModel.cursorLocation.x, self.textEditorModel.cursorLocation.y)
+
+    def _open_mapped(self, fl):
+        # The document starts empty and grows as the background thread indexes the mapped file.
+        # Pieces keep pointing into the map, edits only add new pieces in front of them.
+        self.mappedFile = MappedFile(fl)
+        self._set_model(TextEditorModel(''))
+        self._indexQueue = queue.Queue()
+        self._indexStop = threading.Event()
+        self._indexedEnd = 0
+        self._indexThread = threading.Thread(target=self._index_mapped, args=(self.mappedFile, self._indexQueue, self._indexStop),
+                                             daemon=True)
+        self._indexThread.start()
+        self._indexPoll = self.after(50, self._poll_index)
+
+    @staticmethod
+    def _index_mapped(mappedFile, indexQueue, stop):
+        batch = []
+        for piece in mappedFile.pieces(stop):
+            batch.append(piece)
+            if len(batch) == 256:
+                indexQueue.put(batch)
+                batch = []
+        indexQueue.put(batch)
+        indexQueue.put(None)
+
+    def _poll_index(self):
+        self._indexPoll = None
+        if self._indexQueue is None:
+            return
+        pieces = []
+        done = False
+        while True:
+            try:
+                batch = self._indexQueue.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                done = True
+                break
+            pieces.extend(batch)
+        if pieces:
+            self.textEditorModel.text.append(pieces)
+            # Byte offset in the mapped file up to which the buffer has been filled
+            self._indexedEnd = pieces[-1][0].end
+            self.textEditorModel.text_notify()
+        if done:
+            self._indexQueue = None
+            self._indexStop = None
+            self._indexThread = None
+        else:
+            self._indexPoll = self.after(50, self._poll_index)
+        self._update_status()
+
+    def _stop_indexing(self):
+        # The worker stops after its current chunk, so the map can be closed once it is joined
+        if self._indexStop is not None:
+            self._indexStop.set()
+        if self._indexThread is not None:
+            self._indexThread.join()
+        if self._indexPoll is not None:
+            self.after_cancel(self._indexPoll)
+        self._indexQueue = None
+        self._indexStop = None
+        self._indexThread = None
+        self._indexPoll = None
+
+    def _release_mapped(self, mappedFile):
+        # A running save may still be copying from the map, then it is closed once the save is done
+        if mappedFile is None or mappedFile is self.mappedFile:
+            return
+        if self._saveJob is not None:
+            self._retiredMaps.append(mappedFile)
+        else:
+            mappedFile.close()
 
     def _save(self):
-        if self.filepath is None:
+        # A save requested while another one runs is started once that one is done
+        if self._saveJob is not None:
+            self._saveQueued = True
+            self._update_status()
+            return
+        filepath = self.filepath
+        if filepath is None:
             formats = [('Text file', '*.txt'), ('Python script', '*.py'), ('All', '.*')]
-            filename = tk.filedialog.asksaveasfilename(filetypes=formats)
-            if filename:
-                with open(filename, 'w') as out:
-                    out.write('\n'.join(self.textEditorModel.text))
-                self.filepath = filename
+            filepath = tk.filedialog.asksaveasfilename(filetypes=formats)
+            if not filepath:
+                return
+        # While indexing runs the rest of the mapped file is not in the buffer yet, the save copies it from the map
+        tail = (self.mappedFile, self._indexedEnd) if self._indexQueue is not None else None
+        if self.mappedFile is not None:
+            self._saveJob = SaveJob(self.textEditorModel.text, filepath, self.mappedFile.encoding, tail, self.mappedFile.newline)
         else:
-            with open(self.filename, 'w') as out:
-                out.write('\n'.join(self.textEditorModel.text))
+            self._saveJob = SaveJob(self.textEditorModel.text, filepath)
+        self._saveJob.start()
+        self.after(100, self._poll_save)
+
+    def _poll_save(self):
+        saveJob = self._saveJob
+        if not saveJob.done.is_set():
+            self._update_status()
+            self.after(100, self._poll_save)
+            return
+        self._saveJob = None
+        for mappedFile in self._retiredMaps:
+            mappedFile.close()
+        self._retiredMaps = []
+        # The document may have been replaced while it was saved, the new one keeps its own path
+        if saveJob.error is None and saveJob.source is self.textEditorModel.text:
+            self.filepath = saveJob.filepath
+        self._update_status()
+        if saveJob.error is not None:
+            tk.messagebox.showerror("Save failed", "{}: {}".format(saveJob.filepath, saveJob.error))
+        if self._saveQueued:
+            self._saveQueued = False
+            self._save()
+
+    def _ask_pattern(self, title):
+        pattern = tk.simpledialog.askstring(title, "Find:", initialvalue=self.searchPattern or '', parent=self)
+        if pattern:
+            self.searchPattern = pattern
+        return pattern
+
+    def find(self):
+        if self._ask_pattern("Find"):
+            self.find_next()
+
+    def find_next(self):
+        if not self.searchPattern and not self._ask_pattern("Find"):
+            return
+        try:
+            found = self.textEditorModel.find(self.searchPattern, self.search_regex.get(), self.search_ignore_case.get())
+        except re.error as error:
+            tk.messagebox.showerror("Find", "Invalid regular expression: {}".format(error))
+            return
+        if found is None:
+            tk.messagebox.showinfo("Find", "'{}' was not found.".format(self.searchPattern))
+            return
+        self.textEditorModel.setSelectionRange(found)
+        self.textEditorModel.cursorLocation = Location(found.location2.x, found.location2.y)
+        self.textEditorModel.cursor_notify()
+
+    def replace_all(self):
+        pattern = self._ask_pattern("Replace all")
+        if not pattern:
+            return
+        replacement = tk.simpledialog.askstring("Replace all", "Replace with:", parent=self)
+        if replacement is None:
+            return
+        try:
+            count = self.textEditorModel.replaceAll(pattern, replacement, self.search_regex.get(), self.search_ignore_case.get())
+        except re.error as error:
+            tk.messagebox.showerror("Replace all", "Invalid regular expression: {}".format(error))
+            return
+        tk.messagebox.showinfo("Replace all", "Replaced {} occurrence(s).".format(count))
 
     def move_cursor(self, position):
         if position == 'start':
@@ -631,22 +1932,11 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
             self.paste_and_take()
 
     def clear_document(self):
-        self.textEditorModel.cursor_detach(self)
-        self.textEditorModel.text_detach(self)
-        self.textEditorModel.undoManager.undo_detach(self)
-        self.clipboardStack.clip_detach(self)
-
-        self.textEditorModel = TextEditorModel("")
-        self.clipboardStack.clip_attach(self)
-        self.textEditorModel.cursor_attach(self)
-        self.textEditorModel.text_attach(self)
-        self.textEditorModel.undoManager.undo_attach(self)
-        self.filepath = None
-        self.textChars = []
-        self.cursor = None
-        self.highlight = []
-        self._show_text()
-        self._draw_cursor(self.textEditorModel.cursorLocation.x, self.textEditorModel.cursorLocation.y)
+        self._stop_indexing()
+        mappedFile = self.mappedFile
+        self.mappedFile = None
+        self._set_model(TextEditorModel(""))
+        self._release_mapped(mappedFile)
 
     def cut(self):
         if self.textEditorModel.getSelectionRange() is not None:
@@ -736,16 +2026,18 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
                 self.textEditorModel.moveCursorDown()
             location2 = self.textEditorModel.cursorLocation
             self.textEditorModel.setSelectionRange(LocationRange(self.textEditorModel.getSelectionRange().location1, location2))
-        self._draw_highlight(self.textEditorModel.getSelectionRange().location1, self.textEditorModel.getSelectionRange().location2)
     
     def _draw_highlight(self, location1, location2):
         for hl in self.highlight:
             self.canvas.delete(hl)
+        self.highlight = []
+        first, last = self._visible_range()
         if location1.y == location2.y:
-            hl = self.canvas.create_rectangle(self.textChars[location1.y][location1.x][0], self.textChars[location1.y][location1.x][1],
-                                        self.textChars[location2.y][location2.x][0], self.textChars[location2.y][location2.x][1] + 20,
-                                        stipple="gray12", fill = 'blue', outline='blue')
-            self.highlight.append(hl)
+            if first <= location1.y < last:
+                hl = self.canvas.create_rectangle(self._column_x(location1.y, location1.x), self._line_y(location1.y),
+                                            self._column_x(location2.y, location2.x), self._line_y(location2.y) + 20,
+                                            stipple="gray12", fill = 'blue', outline='blue')
+                self.highlight.append(hl)
         else:
             #from loc_start to loc_end
             if location1.y > location2.y:
@@ -754,31 +2046,51 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
             else:
                 loc_start = location1
                 loc_end = location2
-            for y in range(loc_start.y, loc_end.y + 1):
+            #Only rows inside the viewport are drawn
+            for y in range(max(loc_start.y, first), min(loc_end.y + 1, last)):
                 #Row is equal to start and highlight goes from loc_start.x
                 if y == loc_start.y:
-                    hl = self.canvas.create_rectangle(self.textChars[y][loc_start.x][0], self.textChars[y][loc_start.x][1],
-                                        self.textChars[y][-1][0], self.textChars[y][-1][1] + 20,
-                                        stipple="gray12", fill = 'blue', outline='blue')
-                    self.highlight.append(hl)
+                    x1, x2 = self._column_x(y, loc_start.x), self._line_end_x(y)
                 #Row is equal to end and highlight goes to loc_end.x
                 elif y == loc_end.y:
-                    hl = self.canvas.create_rectangle(self.textChars[y][0][0], self.textChars[y][0][1],
-                                        self.textChars[y][loc_end.x][0], self.textChars[y][loc_end.x][1] + 20,
-                                        stipple="gray12", fill = 'blue', outline='blue')
-                    self.highlight.append(hl)
+                    x1, x2 = self.MARGIN, self._column_x(y, loc_end.x)
                 #Row is between start and end and highlight goes through whole row
                 else:
-                    hl = self.canvas.create_rectangle(self.textChars[y][0][0], self.textChars[y][0][1],
-                                        self.textChars[y][-1][0], self.textChars[y][-1][1] + 20,
-                                        stipple="gray12", fill = 'blue', outline='blue')
-                    self.highlight.append(hl)       
-        self.canvas.pack(fill=tk.BOTH, expand=1)
+                    x1, x2 = self.MARGIN, self._line_end_x(y)
+                hl = self.canvas.create_rectangle(x1, self._line_y(y), x2, self._line_y(y) + 20,
+                                    stipple="gray12", fill = 'blue', outline='blue')
+                self.highlight.append(hl)
+
+    def _schedule_update(self):
+        # Notifications only mark what is stale, the canvas is brought up to date once Tk is idle
+        if self._idle is None:
+            self._idle = self.after_idle(self._flush_updates)
+
+    def _flush_updates(self):
+        self._idle = None
+        cursorLocation = self.textEditorModel.cursorLocation
+        changed = self._dirtyText or self._dirtyLines
+        if (changed or self._dirtyCursor) and self._scroll_into_view(cursorLocation.y):
+            self._dirtyText = True
+        if changed:
+            self._update_edit_menu()
+        if self._dirtyText:
+            self._show_text()
+        else:
+            for y in self._dirtyLines:
+                self._show_line(y)
+            if changed or self._dirtyCursor:
+                self._draw_cursor(cursorLocation.x, cursorLocation.y)
+        if changed or self._dirtyCursor:
+            self._update_status()
+        if self._dirtyUndo:
+            self._update_undo_menu()
+        self._dirtyLines = set()
+        self._dirtyText = self._dirtyCursor = self._dirtyUndo = False
 
     def updateCursorLocation(self, cursorLocation):
-        self._draw_cursor(cursorLocation.x, cursorLocation.y)
-        self.status_label.config(text="Cursor position: ({}, {}), Number of lines: {}"
-                            .format(self.textEditorModel.cursorLocation.x + 1, self.textEditorModel.cursorLocation.y + 1, len(self.textEditorModel.text)))
+        self._dirtyCursor = True
+        self._schedule_update()
 
     def updateClipboard(self):
         if self.clipboardStack.empty():
@@ -790,7 +2102,17 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
             self.edit_menu.entryconfig("Paste and Take", state="normal")
             self.paste_button.config(state=tk.NORMAL)
 
-    def updateText(self):
+    def updateText(self, line=None, column=0):
+        # Cached column offsets are dropped right away, drawing waits for _flush_updates
+        if line is not None:
+            self.columns.lineChanged(line, column)
+            self._dirtyLines.add(line)
+        else:
+            self.columns.clear()
+            self._dirtyText = True
+        self._schedule_update()
+
+    def _update_edit_menu(self):
         if self.textEditorModel.getSelectionRange() is None:
             self.edit_menu.entryconfig("Cut", state="disabled")
             self.edit_menu.entryconfig("Copy", state="disabled")
@@ -801,11 +2123,12 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
             self.edit_menu.entryconfig("Copy", state="normal")
             self.edit_menu.entryconfig("Delete selection", state="normal")
             self.copy_button.config(state=tk.NORMAL)
-        self._show_text()
-        self.status_label.config(text="Cursor position: ({}, {}), Number of lines: {}"
-                                .format(self.textEditorModel.cursorLocation.x + 1, self.textEditorModel.cursorLocation.y + 1, len(self.textEditorModel.text)))
 
     def updateUndo(self):
+        self._dirtyUndo = True
+        self._schedule_update()
+
+    def _update_undo_menu(self):
         if self.textEditorModel.undoManager.empty_undo():
             self.edit_menu.entryconfig("Undo", state="disabled")
             self.undo_button.config(state=tk.DISABLED)
@@ -819,26 +2142,64 @@ class TextEditor(tk.Tk, CursorObserver, TextObserver, ClipboardObserver, UndoSta
             self.edit_menu.entryconfig("Redo", state="normal")
             self.redo_button.config(state=tk.NORMAL)
 
+    def _visible_lines(self):
+        return max(1, (self.canvas.winfo_height() - self.MARGIN) // self.metrics.lineHeight)
+
+    def _visible_range(self):
+        # One extra line so a partially visible last line is drawn as well
+        return self.firstLine, min(self.firstLine + self._visible_lines() + 1, len(self.textEditorModel.text))
+
+    def _line_y(self, y):
+        return self.MARGIN + (y - self.firstLine) * self.metrics.lineHeight
+
+    def _column_x(self, y, x):
+        return self.MARGIN + self.columns.offset(self.textEditorModel.text, y, x)
+
+    def _line_end_x(self, y):
+        return self.MARGIN + self.columns.lineEnd(self.textEditorModel.text, y)
+
+    def scroll(self, lines):
+        firstLine = min(max(self.firstLine + lines, 0), len(self.textEditorModel.text) - 1)
+        if firstLine != self.firstLine:
+            self.firstLine = firstLine
+            self._show_text()
+
+    def _scroll_into_view(self, y):
+        # Moves the viewport so line y is visible, returns True if it moved
+        visible = self._visible_lines()
+        if y < self.firstLine:
+            self.firstLine = y
+        elif y >= self.firstLine + visible:
+            self.firstLine = y - visible + 1
+        else:
+            return False
+        return True
+
     def _draw_cursor(self, x, y):
         self.canvas.delete(self.cursor)
-        self.cursor = self.canvas.create_line(self.textChars[y][x][0], self.textChars[y][x][1],
-                                              self.textChars[y][x][0], self.textChars[y][x][1] + 15, fill="#000")
-        self.canvas.pack(fill=tk.BOTH, expand=1)
+        self.cursor = None
+        first, last = self._visible_range()
+        if first <= y < last:
+            self.cursor = self.canvas.create_line(self._column_x(y, x), self._line_y(y),
+                                                  self._column_x(y, x), self._line_y(y) + 15, fill="#000")
+
+    def _show_line(self, y):
+        item = self.lineItems.get(y)
+        if item is not None:
+            self.canvas.itemconfig(item, text=self.textEditorModel.text[y])
 
     def _show_text(self):
         self.canvas.delete("all")
-        self.textChars = []
-        y = 10
-        for i, line in enumerate(self.textEditorModel.allLines()):
-            self.textChars.append([])
-            x = 10
-            for char in line:
-                text = self.canvas.create_text(x, y, anchor=tk.NW, text=char)
-                self.textChars[i].append([x, y])
-                x += (self.canvas.bbox(text)[2] - self.canvas.bbox(text)[0])
-            self.textChars[i].append([x, y])
-            y += 20
-        self.canvas.pack(fill=tk.BOTH, expand=1)
+        self.lineItems = {}
+        self.highlight = []
+        first, last = self._visible_range()
+        self.columns.retain(first, last)
+        for y, line in enumerate(self.textEditorModel.linesRange(first, last), first):
+            self.lineItems[y] = self.canvas.create_text(self.MARGIN, self._line_y(y), anchor=tk.NW, text=line, font=self.metrics.font)
+        selectionRange = self.textEditorModel.getSelectionRange()
+        if selectionRange is not None:
+            self._draw_highlight(selectionRange.location1, selectionRange.location2)
+        self._draw_cursor(self.textEditorModel.cursorLocation.x, self.textEditorModel.cursorLocation.y)
             
     def _close_window(self):
         self.destroy()
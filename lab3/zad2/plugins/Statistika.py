@@ -13,11 +13,12 @@ class Statistika:
         return self.description
 
     def execute(self, textEditorModel, undoManager, clipboardStack):
-        number_of_lines = len(textEditorModel.text)
-        number_of_words = sum([len(line.split()) for line in textEditorModel.text])
-        number_of_letters = 0
-        for line in textEditorModel.text:
-            for word in line.split():
-                number_of_letters += len(word)
+        # The model keeps the counts up to date, while they are still being counted in the
+        # background this checks back later instead of blocking the editor
+        totals = textEditorModel.statistics.totals(textEditorModel.text)
+        if totals is None:
+            tk._default_root.after(100, self.execute, textEditorModel, undoManager, clipboardStack)
+            return
+        number_of_lines, number_of_words, number_of_letters = totals
         tk.messagebox.showinfo('Statistika', 'Number of lines: {}\nNumber of words: {}\nNumber of letters: {}'
         .format(number_of_lines, number_of_words, number_of_letters))
\ No newline at end of file
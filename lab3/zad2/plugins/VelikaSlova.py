@@ -1,3 +1,39 @@
+import re
+
+# First character of every word, a word being a run of non-whitespace like in str.split()
+WORD_START = re.compile(r'(?<!\S)\S')
+# Lines are transformed in blocks of about this many characters, each changed block is one edit
+BLOCK = 64 * 1024
+
+
+def _upper(match):
+    return match.group().upper()
+
+
+def capitalize_edits(lines):
+    # (start, end, replacement) edits over the text the lines make up, one regex pass per block
+    edits = []
+    block = []
+    block_start = offset = 0
+    for line in lines:
+        block.append(line)
+        offset += len(line) + 1
+        if offset - block_start >= BLOCK:
+            _add_edit(edits, block, block_start, offset - 1)
+            block = []
+            block_start = offset
+    if block:
+        _add_edit(edits, block, block_start, offset - 1)
+    return edits
+
+
+def _add_edit(edits, block, start, end):
+    text = '\n'.join(block)
+    changed = WORD_START.sub(_upper, text)
+    if changed != text:
+        edits.append((start, end, changed))
+
+
 class VelikaSlova:
 
     def __init__(self):
@@ -10,11 +46,8 @@ class VelikaSlova:
     def getDescription(self):
         return self.description
 
+    def run(self, text):
+        return capitalize_edits(text.split('\n')), None
+
     def execute(self, textEditorModel, undoManager, clipboardStack):
-        for line in textEditorModel.text:
-            line_buff = []
-            for word in line.split():
-                word = word[0].upper() + word[1:]
-                line_buff.append(word)
-            textEditorModel.text[textEditorModel.text.index(line)] = ' '.join(line_buff)
-            textEditorModel.text_notify()
\ No newline at end of file
+        textEditorModel.applyEditScript(capitalize_edits(textEditorModel.allLines()))
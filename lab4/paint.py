@@ -2,11 +2,26 @@ import tkinter as tk
 import tkinter.filedialog
 import math
 import abc
+import gzip
+import io
+import mmap
+import os
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
 from abc import abstractmethod, ABC
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class Point:
 
+    __slots__ = ('_x', '_y')
+
     def __init__(self, x: float, y: float):
         self._x = x
         self._y = y
@@ -65,6 +80,9 @@ class Renderer(ABC):
     def fillPolygon(self, points: list) -> None:
         pass
 
+    def getTessellationTolerance(self) -> float:
+        return 0.25
+
 
 class GeometryUtil:
 
@@ -74,67 +92,65 @@ class GeometryUtil:
 
     @staticmethod
     def distanceFromLineSegment(s: Point, e: Point, p: Point) -> float:
-        #TODO: FIX distanceFromLineSegment method
-        def line(s, e):
-            a = (e.getY() - s.getY())/(e.getX() - s.getX())
-            b = a * -s.getX() + s.getY()
-            return [a, b]
-        
-        s, e = sorted([s, e], key=lambda point: (point.getX(), point.getY()))
+        return GeometryUtil.distanceFromLineSegmentXY(s.getX(), s.getY(), e.getX(), e.getY(), p.getX(), p.getY())
 
+    @staticmethod
+    def distanceFromLineSegmentXY(sx: float, sy: float, ex: float, ey: float, px: float, py: float) -> float:
+        dx = ex - sx
+        dy = ey - sy
+        length_squared = dx * dx + dy * dy
         # If start point and end point are equal, return distance from either one
-        if e.getX() == s.getX() and e.getY() == s.getY():
-            return GeometryUtil.distanceFromPoint(p, e)
-
-        # Check for edge case where sx - ex = 0
-        if e.getX() == s.getX():
-            if p.getY() <= s.getY():
-                return GeometryUtil.distanceFromPoint(p, s)
-            elif p.getY() >= e.getY():
-                return GeometryUtil.distanceFromPoint(p, e)
-            else:
-                if p.getX() == e.getX():
-                    return 0.0
-                else:
-                    return GeometryUtil.distanceFromPoint(p, Point(s.getX(), p.getY()))
-
-        # Check for edge case where sy - ey = 0
-        if e.getY() == s.getY():
-            if p.getX() <= s.getX():
-                return GeometryUtil.distanceFromPoint(p, s)
-            elif p.getX() >= e.getX():
-                return GeometryUtil.distanceFromPoint(p, e)
-            else:
-                if p.getY() == e.getY():
-                    return 0.0
-                else:
-                    return GeometryUtil.distanceFromPoint(p, Point(p.getX(), s.getY()))
-
-        a, b = line(s, e)
-        # Line is not vertical and point is on the line
-        if a * p.getX() + b == p.getY():
-            if p.getX() <= s.getX():
-                return GeometryUtil.distanceFromPoint(s, p)
-            elif p.getX() >= e.getX():
-                return GeometryUtil.distanceFromPoint(e, p)
-            else:
-                return 0.0
-        # Line is not vertical and point is not on the line
-        else:
-            #Find vertical from point to line
-            a_v = -1/a
-            b_v = p.getY() - a_v * p.getX()
-            x = (b - b_v) / (a_v - a)
-            y = a_v * x + b_v
-            if x <= e.getX() and x >= s.getX():
-                return GeometryUtil.distanceFromPoint(p, Point(x, y))
-            elif x > e.getX():
-                return GeometryUtil.distanceFromPoint(p, e)
-            else:
-                return GeometryUtil.distanceFromPoint(p, s)
+        if length_squared == 0:
+            return math.hypot(px - sx, py - sy)
+        # Project point onto the segment and clamp the projection to its ends
+        t = ((px - sx) * dx + (py - sy) * dy) / length_squared
+        t = min(max(t, 0.0), 1.0)
+        return math.hypot(px - sx - t * dx, py - sy - t * dy)
+
+    @staticmethod
+    def distanceFromRectangle(x: float, y: float, width: float, height: float, px: float, py: float) -> float:
+        # Zero inside the rectangle, otherwise distance to the nearest edge
+        min_x, max_x = (x, x + width) if width >= 0 else (x + width, x)
+        min_y, max_y = (y, y + height) if height >= 0 else (y + height, y)
+        dx = max(min_x - px, 0.0, px - max_x)
+        dy = max(min_y - py, 0.0, py - max_y)
+        return math.hypot(dx, dy)
+
+
+class EllipseTessellator:
+
+    _MIN_VERTICES = 8
+    _MAX_VERTICES = 2048
+    _unitCircles = {}
+
+    @staticmethod
+    def vertexCount(a: float, b: float, tolerance: float) -> int:
+        #Sagitta of a regular n-gon inscribed in a circle of radius r is r * (1 - cos(pi / n))
+        radius = max(abs(a), abs(b))
+        if radius <= tolerance:
+            return EllipseTessellator._MIN_VERTICES
+        n = math.ceil(math.pi / math.acos(1 - tolerance / radius))
+        return min(max(n, EllipseTessellator._MIN_VERTICES), EllipseTessellator._MAX_VERTICES)
+
+    @staticmethod
+    def _unitCircle(n: int) -> tuple:
+        circle = EllipseTessellator._unitCircles.get(n)
+        if circle is None:
+            step = 2 * math.pi / n
+            circle = (tuple(math.cos(i * step) for i in range(n)), tuple(math.sin(i * step) for i in range(n)))
+            EllipseTessellator._unitCircles[n] = circle
+        return circle
+
+    @staticmethod
+    def tessellate(center: Point, a: float, b: float, tolerance: float) -> list:
+        cos_table, sin_table = EllipseTessellator._unitCircle(EllipseTessellator.vertexCount(a, b, tolerance))
+        p, q = center.getX(), center.getY()
+        return [Point(p + a * c, q + b * s) for c, s in zip(cos_table, sin_table)]
 
 
 class Rectangle:
+
+    __slots__ = ('_x', '_y', '_width', '_height')
     
     def __init__(self, x: float, y: float, width: float, height: float):
         self._x = x
@@ -155,6 +171,169 @@ class Rectangle:
         return self._height
 
 
+class GridIndex:
+
+    #Objects covering more than MAX_CELLS cells (long lines, large composites) are kept in one list
+    #that every query returns instead, so moving them does not touch thousands of cells.
+    #Objects without a bounding box (empty composites) are not indexed and can't be hit
+    MAX_CELLS = 64
+
+    def __init__(self, cellSize: float = 64, margin: float = 0):
+        self._cellSize = cellSize
+        self._margin = margin
+        self._cells = {}
+        self._objectCells = {}
+        self._oversized = set()
+
+    def _cellRange(self, rectangle: Rectangle) -> tuple:
+        min_x, max_x = sorted([rectangle.getX(), rectangle.getX() + rectangle.getWidth()])
+        min_y, max_y = sorted([rectangle.getY(), rectangle.getY() + rectangle.getHeight()])
+        start_i = math.floor((min_x - self._margin) / self._cellSize)
+        end_i = math.floor((max_x + self._margin) / self._cellSize)
+        start_j = math.floor((min_y - self._margin) / self._cellSize)
+        end_j = math.floor((max_y + self._margin) / self._cellSize)
+        return start_i, end_i, start_j, end_j
+
+    def insert(self, go) -> None:
+        rectangle = go.getBoundingBox()
+        cells = []
+        if rectangle is not None:
+            start_i, end_i, start_j, end_j = self._cellRange(rectangle)
+            if (end_i - start_i + 1) * (end_j - start_j + 1) > self.MAX_CELLS:
+                self._oversized.add(go)
+            else:
+                cells = [(i, j) for i in range(start_i, end_i + 1) for j in range(start_j, end_j + 1)]
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(go)
+        self._objectCells[go] = cells
+
+    def remove(self, go) -> None:
+        self._oversized.discard(go)
+        for cell in self._objectCells.pop(go, []):
+            bucket = self._cells[cell]
+            bucket.discard(go)
+            if not bucket:
+                del self._cells[cell]
+
+    def update(self, go) -> None:
+        if go in self._objectCells:
+            self.remove(go)
+            self.insert(go)
+
+    def query(self, point: Point) -> set:
+        cell = (math.floor(point.getX() / self._cellSize), math.floor(point.getY() / self._cellSize))
+        bucket = self._cells.get(cell, set())
+        return bucket | self._oversized if self._oversized else bucket
+
+    def clear(self) -> None:
+        self._cells = {}
+        self._objectCells = {}
+        self._oversized = set()
+
+
+class SelectionDistanceBatch:
+
+    _LINE = 0
+    _BOX = 1
+
+    def __init__(self):
+        self._rows = {}
+        self._objects = []
+        self._kinds = array('b')
+        #One x0, y0, x1, y1 row per object: segment ends for lines, normalized bounding box otherwise
+        self._coords = array('d')
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def objects(self) -> list:
+        return self._objects
+
+    def rows(self, objects) -> list:
+        return [self._rows[o] for o in objects]
+
+    def insert(self, go) -> None:
+        self._rows[go] = len(self._objects)
+        self._objects.append(go)
+        self._kinds.append(self._LINE)
+        self._coords.extend((0.0, 0.0, 0.0, 0.0))
+        self.update(go)
+
+    def remove(self, go) -> None:
+        row = self._rows.pop(go, None)
+        if row is None:
+            return
+        last = len(self._objects) - 1
+        if row != last:
+            moved = self._objects[last]
+            self._objects[row] = moved
+            self._rows[moved] = row
+            self._kinds[row] = self._kinds[last]
+            self._coords[4 * row:4 * row + 4] = self._coords[4 * last:4 * last + 4]
+        self._objects.pop()
+        self._kinds.pop()
+        del self._coords[4 * last:]
+
+    def update(self, go) -> None:
+        row = self._rows.get(go)
+        if row is None:
+            return
+        if isinstance(go, LineSegment):
+            self._kinds[row] = self._LINE
+            self._coords[4 * row:4 * row + 4] = go.getHotPointCoords()
+        elif go.getBoundingBox() is None:
+            #Nothing to hit, the row stays infinitely far away
+            self._kinds[row] = self._BOX
+            self._coords[4 * row:4 * row + 4] = array('d', (math.inf,) * 4)
+        else:
+            rectangle = go.getBoundingBox()
+            min_x, max_x = sorted([rectangle.getX(), rectangle.getX() + rectangle.getWidth()])
+            min_y, max_y = sorted([rectangle.getY(), rectangle.getY() + rectangle.getHeight()])
+            self._kinds[row] = self._BOX
+            self._coords[4 * row:4 * row + 4] = array('d', (min_x, min_y, max_x, max_y))
+
+    def clear(self) -> None:
+        self._rows = {}
+        self._objects = []
+        self._kinds = array('b')
+        self._coords = array('d')
+
+    def distances(self, mousePoint: Point, rows: list = None):
+        if np is None:
+            return self._scalarDistances(mousePoint, rows)
+        px, py = mousePoint.getX(), mousePoint.getY()
+        coords = np.frombuffer(self._coords, dtype=np.float64).reshape(-1, 4)
+        kinds = np.frombuffer(self._kinds, dtype=np.int8)
+        if rows is not None:
+            coords = coords[rows]
+            kinds = kinds[rows]
+        x0, y0, x1, y1 = coords.T
+        #Distance from line segments
+        dx = x1 - x0
+        dy = y1 - y0
+        length_squared = dx * dx + dy * dy
+        t = ((px - x0) * dx + (py - y0) * dy) / np.where(length_squared == 0, 1.0, length_squared)
+        t = np.clip(t, 0.0, 1.0)
+        segment_distance = np.hypot(px - x0 - t * dx, py - y0 - t * dy)
+        #Distance from bounding boxes, zero inside
+        box_distance = np.hypot(np.maximum(np.maximum(x0 - px, 0.0), px - x1),
+                                np.maximum(np.maximum(y0 - py, 0.0), py - y1))
+        return np.where(kinds == self._LINE, segment_distance, box_distance)
+
+    def _scalarDistances(self, mousePoint: Point, rows: list = None) -> list:
+        px, py = mousePoint.getX(), mousePoint.getY()
+        distances = []
+        for row in (range(len(self._objects)) if rows is None else rows):
+            x0, y0, x1, y1 = self._coords[4 * row:4 * row + 4]
+            if self._kinds[row] == self._LINE:
+                distances.append(GeometryUtil.distanceFromLineSegmentXY(x0, y0, x1, y1, px, py))
+            elif x0 == math.inf:
+                distances.append(math.inf)
+            else:
+                distances.append(GeometryUtil.distanceFromRectangle(x0, y0, x1 - x0, y1 - y0, px, py))
+        return distances
+
+
 class GraphicalObject:
 
     def isSelected(self) -> bool:
@@ -216,33 +395,49 @@ class GraphicalObject:
 
 
 class AbstractGraphicalObject(GraphicalObject, ABC):
-    _hot_points: list
+    _coords: array
     _hot_points_selected: list
     _selected: bool
     _listeners: list
 
     def __init__(self, points: list = None):
+        #Hotpoints are kept as a flat x0, y0, x1, y1, ... buffer of doubles
+        self._coords = array('d')
         if points:
-            self._hot_points = points
+            for point in points:
+                self._coords.append(point.getX())
+                self._coords.append(point.getY())
             self._hot_points_selected = [False] * len(points)
         else:
-            self._hot_points = []
             self._hot_points_selected = []
         self._selected = False
         self._listeners = []
 
     def getHotPoint(self, index: int) -> Point:
-        return self._hot_points[index]
+        return Point(self._coords[2 * index], self._coords[2 * index + 1])
+
+    def getHotPointCoords(self) -> array:
+        return self._coords
+
+    @classmethod
+    def fromCoords(cls, coords: array):
+        #Takes over a flat x0, y0, x1, y1, ... buffer without going through Point objects
+        go = cls.__new__(cls)
+        AbstractGraphicalObject.__init__(go)
+        go._coords = coords
+        go._hot_points_selected = [False] * (len(coords) // 2)
+        return go
     
     def setHotPoint(self, index: int,  point: Point) -> None:
-        self._hot_points[index] = point
+        self._coords[2 * index] = point.getX()
+        self._coords[2 * index + 1] = point.getY()
         self.notifyListeners()
 
     def getNumberOfHotpoints(self) -> int:
-        return len(self._hot_points)
+        return len(self._coords) // 2
 
     def getHotPointDistance(self, index: int, mousePoint: Point) -> float:
-        return GeometryUtil.distanceFromPoint(self.getHotPoint(index), mousePoint)
+        return math.hypot(self._coords[2 * index] - mousePoint.getX(), self._coords[2 * index + 1] - mousePoint.getY())
     
     def isHotPointSelected(self, index: int) -> bool:
         return self._hot_points_selected[index]
@@ -258,8 +453,11 @@ class AbstractGraphicalObject(GraphicalObject, ABC):
         self.notifySelectionListeners()
 
     def translate(self, point: Point) -> None:
-        for i in range(len(self._hot_points)):
-            self._hot_points[i] = self._hot_points[i].translate(point)
+        dx, dy = point.getX(), point.getY()
+        coords = self._coords
+        for i in range(0, len(coords), 2):
+            coords[i] += dx
+            coords[i + 1] += dy
         self.notifyListeners()
     
     def addGraphicalObjectListener(self, listener) -> None:
@@ -293,12 +491,14 @@ class LineSegment(AbstractGraphicalObject):
         super().__init__([_starting_point, _ending_point])
 
     def selectionDistance(self, mousePoint: Point) -> float:
-        return GeometryUtil.distanceFromLineSegment(self.getHotPoint(0), self.getHotPoint(1), mousePoint)
+        sx, sy, ex, ey = self._coords
+        return GeometryUtil.distanceFromLineSegmentXY(sx, sy, ex, ey, mousePoint.getX(), mousePoint.getY())
 
     def getBoundingBox(self) -> Rectangle:
-        starting_point, ending_point = sorted(self._hot_points, key=lambda vertex: (vertex.getX(), vertex.getY()))
-        width, height = ending_point.difference(starting_point).getX(), ending_point.difference(starting_point).getY()
-        return Rectangle(starting_point.getX(), starting_point.getY(), width, height)
+        sx, sy, ex, ey = self._coords
+        if (ex, ey) < (sx, sy):
+            sx, sy, ex, ey = ex, ey, sx, sy
+        return Rectangle(sx, sy, ex - sx, ey - sy)
 
     def duplicate(self):
         return LineSegment(self.getHotPoint(0), self.getHotPoint(1))
@@ -338,7 +538,14 @@ class Oval(AbstractGraphicalObject):
 
         super().__init__([_right_hotpoint, _bottom_hotpoint])
         self._center = Point(_bottom_hotpoint.getX(), _right_hotpoint.getY())
+        self._tessellation = (None, None)
 
+    @classmethod
+    def fromCoords(cls, coords: array):
+        oval = super().fromCoords(coords)
+        oval._center = Point(coords[2], coords[1])
+        oval._tessellation = (None, None)
+        return oval
 
     def translate(self, point: Point) -> None:
         super().translate(point)
@@ -347,30 +554,17 @@ class Oval(AbstractGraphicalObject):
 
     def selectionDistance(self, mousePoint: Point) -> float:
         rectangle = self.getBoundingBox()
-
-        #Check if mousePoint is inside object
-        rectangle_x_range = sorted([rectangle.getX(), rectangle.getX() + rectangle.getWidth()])
-        rectangle_y_range = sorted([rectangle.getY(), rectangle.getY() + rectangle.getHeight()])
-        if mousePoint.getX() >= rectangle_x_range[0] and mousePoint.getX() <= rectangle_x_range[1] and\
-           mousePoint.getY() >= rectangle_y_range[0] and mousePoint.getY() <= rectangle_y_range[1]:
-            return 0
-        
-        points = []
-        points.append(Point(rectangle.getX(), rectangle.getY()))
-        points.append(Point(rectangle.getX() + rectangle.getWidth(), rectangle.getY()))
-        points.append(Point(rectangle.getX(), rectangle.getY() + rectangle.getHeight()))
-        points.append(Point(rectangle.getX() + rectangle.getWidth(), rectangle.getY() + rectangle.getHeight()))
-        line_segments = [(points[0], points[1]),(points[0], points[2]),
-                         (points[1], points[3]), (points[2], points[3])]
-        return min([GeometryUtil.distanceFromLineSegment(ls[0], ls[1], mousePoint) for ls in line_segments])
+        return GeometryUtil.distanceFromRectangle(rectangle.getX(), rectangle.getY(), rectangle.getWidth(),
+                                                  rectangle.getHeight(), mousePoint.getX(), mousePoint.getY())
 
     def getBoundingBox(self) -> Rectangle:
-        bottom_hotpoint, right_hotpoint = sorted(self._hot_points, key=lambda vertex: (vertex.getX(), vertex.getY()))
-        rectangle_point_x = 2 * bottom_hotpoint.getX() - right_hotpoint.getX()
-        rectangle_point_y = bottom_hotpoint.getY()
-        width = right_hotpoint.getX() - rectangle_point_x
-        height = 2 * right_hotpoint.getY() - 2 * bottom_hotpoint.getY()
-        return Rectangle(rectangle_point_x, rectangle_point_y, width, height)
+        bx, by, rx, ry = self._coords
+        if (bx, by) > (rx, ry):
+            bx, by, rx, ry = rx, ry, bx, by
+        rectangle_point_x = 2 * bx - rx
+        width = rx - rectangle_point_x
+        height = 2 * ry - 2 * by
+        return Rectangle(rectangle_point_x, by, width, height)
 
     def duplicate(self):
         return Oval(self.getHotPoint(0), self.getHotPoint(1))
@@ -378,44 +572,20 @@ class Oval(AbstractGraphicalObject):
     def getShapeName(self) -> str:
         return "Oval"
 
-    def render(self, rendrer):
-        #Create points
-        points = []
-        boundingBox = self.getBoundingBox()
-        start_x = boundingBox.getX()
-        end_x = boundingBox.getX() + boundingBox.getWidth()
-
-        #Get discrete x's
-        xes = []
-        x = start_x
-        while x <= end_x:
-            xes.append(x)
-            x += .1
-
-
-        self._center = Point(self.getHotPoint(1).getX(), self.getHotPoint(0).getY())
-        
-        #Calculate elipse equation
-
-        a = boundingBox.getWidth() / 2
-        b = boundingBox.getHeight() / 2
-        p = self._center.getX()
-        q = self._center.getY()
-
-        for x in xes:
-            #TODO: Fix math domain error
-            try:
-                y1 = math.sqrt((1 - (x - p) ** 2 / a ** 2) * b ** 2) + q
-                y2 = - math.sqrt((1 - (x - p) ** 2 / a ** 2) * b ** 2) + q
+    def getPolygon(self, tolerance: float) -> list:
+        rx, ry, bx, by = self._coords
+        key = (rx, ry, bx, by, tolerance)
+        cached_key, points = self._tessellation
+        if cached_key != key:
+            self._center = Point(bx, ry)
+            a = abs(rx - bx)
+            b = abs(by - ry)
+            points = EllipseTessellator.tessellate(self._center, a, b, tolerance)
+            self._tessellation = (key, points)
+        return points
 
-                if y1 != y2:
-                    index = int(len(points)/2)
-                    points.insert(index, Point(x, y1))
-                    points.insert(index + 1, Point(x, y2))
-            except ValueError:
-                pass
-
-        rendrer.fillPolygon(points)
+    def render(self, rendrer):
+        rendrer.fillPolygon(self.getPolygon(rendrer.getTessellationTolerance()))
 
     @staticmethod
     def getShapeID():
@@ -433,7 +603,7 @@ class Oval(AbstractGraphicalObject):
 class DocumentModelListener(ABC):
 
     @abstractmethod
-    def documentChange(self) -> None:
+    def documentChange(self, changed: set = None) -> None:
         pass
     
 
@@ -452,12 +622,15 @@ class DocumentModel:
             self._notify_method_selection_changed(go)
 
     _SELECTION_PROXIMITY = 10
+    _BATCH_THRESHOLD = 64
     _objects: list
     _roObjects: tuple
     _listeners: list
     _selectedObjects: list
     _roSelectedObjects: tuple
     _goListener: GraphicObjectListener
+    _index: GridIndex
+    _zOrder: dict
 
     def __init__(self):
         self._objects = []
@@ -466,12 +639,24 @@ class DocumentModel:
         self._selectedObjects = []
         self._roSelectedObjects = tuple(self._selectedObjects)
         self._goListener = self.DocumentModelGOListener(self._graphicalObjectChanged, self._graphicalObjectSelectionChanged)
+        self._index = GridIndex(margin=self._SELECTION_PROXIMITY)
+        self._batch = SelectionDistanceBatch()
+        self._zOrder = {}
+        self._zCounter = 0
+        self._batchDepth = 0
+        self._batchChanged = set()
+        self._batchFull = False
+        self._batchPending = False
+        self._pendingReindex = set()
 
     def clear(self) -> None:
         for o in self._objects:
             o.removeGraphicalObjectListener(self._goListener)
         self._objects = []
         self._selectedObjects = []
+        self._index.clear()
+        self._batch.clear()
+        self._zOrder = {}
         self._doBookkeeping()
         self.notifyListeners()
 
@@ -482,19 +667,26 @@ class DocumentModel:
     def addGraphicalObject(self, graphical_object: GraphicalObject) -> None:
         graphical_object.addGraphicalObjectListener(self._goListener)
         self._objects.append(graphical_object)
+        self._index.insert(graphical_object)
+        self._batch.insert(graphical_object)
+        self._zOrder[graphical_object] = self._zCounter
+        self._zCounter += 1
         if graphical_object.isSelected():
             self._selectedObjects.append(graphical_object)
         self._doBookkeeping()
-        self.notifyListeners()
+        self.notifyListeners({graphical_object})
 
     def removeGraphicalObject(self, graphical_object: GraphicalObject) -> None:
         if graphical_object in self._objects:
             graphical_object.removeGraphicalObjectListener(self._goListener)
             self._objects.remove(graphical_object)
+            self._index.remove(graphical_object)
+            self._batch.remove(graphical_object)
+            del self._zOrder[graphical_object]
             if graphical_object.isSelected():
                 self._selectedObjects.remove(graphical_object)
             self._doBookkeeping()
-        self.notifyListeners()
+        self.notifyListeners({graphical_object})
 
     def list(self) -> tuple:
         return self._roObjects
@@ -506,7 +698,18 @@ class DocumentModel:
         self._listeners.remove(listener)
 
     def _graphicalObjectChanged(self, go: GraphicalObject):
-        self.notifyListeners()
+        if self._batchDepth:
+            self._pendingReindex.add(go)
+        else:
+            self._index.update(go)
+            self._batch.update(go)
+        self.notifyListeners({go})
+
+    def _reindexPending(self) -> None:
+        for go in self._pendingReindex:
+            self._index.update(go)
+            self._batch.update(go)
+        self._pendingReindex = set()
     
     def _graphicalObjectSelectionChanged(self, go: GraphicalObject):
         if go.isSelected() and go not in self._selectedObjects:
@@ -514,11 +717,36 @@ class DocumentModel:
         elif not go.isSelected() and go in self._selectedObjects:
             self._selectedObjects.remove(go)
         self._doBookkeeping()
-        self.notifyListeners()
-
-    def notifyListeners(self) -> None:
+        #Selection decorations of the other selected objects depend on how many are selected
+        self.notifyListeners(set(self._selectedObjects) | {go})
+
+    @contextmanager
+    def batch(self):
+        #Notifications inside the block are merged into a single documentChange when the outermost block ends
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+            if self._batchDepth == 0:
+                self._reindexPending()
+                if self._batchPending:
+                    changed = None if self._batchFull else self._batchChanged
+                    self._batchChanged = set()
+                    self._batchFull = False
+                    self._batchPending = False
+                    self.notifyListeners(changed)
+
+    def notifyListeners(self, changed: set = None) -> None:
+        if self._batchDepth:
+            self._batchPending = True
+            if changed is None:
+                self._batchFull = True
+            else:
+                self._batchChanged |= changed
+            return
         for l in self._listeners:
-            l.documentChange()
+            l.documentChange(changed)
 
     def getSelectedObjects(self) -> tuple:
         return self._roSelectedObjects
@@ -527,6 +755,7 @@ class DocumentModel:
         index = self._objects.index(go)
         if index < len(self._objects) - 1:
             self._objects[index], self._objects[index + 1] = self._objects[index + 1], self._objects[index]
+            self._swapZ(self._objects[index], self._objects[index + 1])
         self._doBookkeeping()
         self.notifyListeners()
 
@@ -534,11 +763,42 @@ class DocumentModel:
         index = self._objects.index(go)
         if index > 0:
             self._objects[index], self._objects[index - 1] = self._objects[index - 1], self._objects[index]
+            self._swapZ(self._objects[index], self._objects[index - 1])
         self._doBookkeeping()
         self.notifyListeners()
     
+    def _swapZ(self, go1: GraphicalObject, go2: GraphicalObject) -> None:
+        self._zOrder[go1], self._zOrder[go2] = self._zOrder[go2], self._zOrder[go1]
+
+    def getZ(self, go: GraphicalObject) -> int:
+        return self._zOrder.get(go, -1)
+
+    def objectAbove(self, go: GraphicalObject) -> GraphicalObject:
+        #_objects is kept in ascending z, so the next object up is found by bisecting on z
+        z = self._zOrder[go]
+        low, high = 0, len(self._objects)
+        while low < high:
+            middle = (low + high) // 2
+            if self._zOrder[self._objects[middle]] <= z:
+                low = middle + 1
+            else:
+                high = middle
+        return self._objects[low] if low < len(self._objects) else None
+
+    def getSelectionDistanceBatch(self) -> SelectionDistanceBatch:
+        return self._batch
+
     def findSelectedGraphicalObject(self, mousePoint: Point) -> int:
-        for o in self._objects[::-1]:
+        self._reindexPending()
+        #Only objects whose bounding box (expanded by selection proximity) covers the point can be hit
+        candidates = self._index.query(mousePoint)
+        if np is not None and len(candidates) >= self._BATCH_THRESHOLD:
+            candidates = list(candidates)
+            distances = self._batch.distances(mousePoint, self._batch.rows(candidates))
+            hits = [candidates[i] for i in np.flatnonzero(distances <= self._SELECTION_PROXIMITY)]
+            return max(hits, key=lambda o: self._zOrder[o]) if hits else None
+        candidates = sorted(candidates, key=lambda o: self._zOrder[o], reverse=True)
+        for o in candidates:
             if o.selectionDistance(mousePoint) <= self._SELECTION_PROXIMITY:
                 return o
         return None
@@ -733,7 +993,6 @@ class SelectShapeState(State):
             for hotpoint in range(child.getNumberOfHotpoints()):
                 new_hotpoint = child.getHotPoint(hotpoint).translate(hot_point_translate)
                 child.setHotPoint(hotpoint, new_hotpoint)
-        self._model.notifyListeners()
 
 
     def keyPressed(self, keyChar: str):
@@ -746,25 +1005,28 @@ class SelectShapeState(State):
                 hot_point_translate = Point(-1, 0)
             elif keyChar == 'Right':
                 hot_point_translate = Point(1, 0)
-            for selected_object in self._model.getSelectedObjects():
-                if isinstance(selected_object, Composite):
-                    self._move_composite(selected_object, hot_point_translate)
-                else:
-                    for hotpoint in range(selected_object.getNumberOfHotpoints()):
-                        new_hotpoint = selected_object.getHotPoint(hotpoint).translate(hot_point_translate)
-                        selected_object.setHotPoint(hotpoint, new_hotpoint)
+            with self._model.batch():
+                for selected_object in self._model.getSelectedObjects():
+                    if isinstance(selected_object, Composite):
+                        self._move_composite(selected_object, hot_point_translate)
+                    else:
+                        for hotpoint in range(selected_object.getNumberOfHotpoints()):
+                            new_hotpoint = selected_object.getHotPoint(hotpoint).translate(hot_point_translate)
+                            selected_object.setHotPoint(hotpoint, new_hotpoint)
         elif keyChar == 'KP_Add':
-            for selected_object in self._model.getSelectedObjects():
-                self._model.increaseZ(selected_object)
+            with self._model.batch():
+                for selected_object in self._model.getSelectedObjects():
+                    self._model.increaseZ(selected_object)
         elif keyChar == 'KP_Subtract':
-            for selected_object in self._model.getSelectedObjects():
-                self._model.decreaseZ(selected_object)
+            with self._model.batch():
+                for selected_object in self._model.getSelectedObjects():
+                    self._model.decreaseZ(selected_object)
         elif keyChar == 'g':
             self._context.transition_to(CompositeState(self._model, Composite(self._model.getSelectedObjects())))
         
 
     def afterDraw(self, r: Renderer, go: GraphicalObject = None):
-        if go is not None and go in self._model.getSelectedObjects():
+        if go is not None and go in self._model.getSelectedObjects() and go.getBoundingBox() is not None:
             rectangle = go.getBoundingBox()
             points = []
             points.append(Point(rectangle.getX(), rectangle.getY()))
@@ -794,62 +1056,80 @@ class SelectShapeState(State):
 
 
 class Composite(AbstractGraphicalObject):
+
+    class CompositeChildListener:
+
+        def __init__(self, notify_method_changed):
+            self._notify_method_changed = notify_method_changed
+
+        def graphicalObjectChanged(self, go) -> None:
+            self._notify_method_changed()
+
+        def graphicalObjectSelectionChanged(self, go) -> None:
+            pass
     
     def __init__(self, children=[]):
         super().__init__()
         self._children = children
+        self._boundingBox = None
+        self._childListener = self.CompositeChildListener(self._childChanged)
+        for child in self._children:
+            child.addGraphicalObjectListener(self._childListener)
+
+    def _childChanged(self) -> None:
+        #Nested composites listen to this one, so invalidation travels up to the root
+        self._boundingBox = None
+        self.notifyListeners()
 
     def getChildren(self):
         return self._children
 
     def add(self, component):
         self._children.append(component)
+        component.addGraphicalObjectListener(self._childListener)
+        self._boundingBox = None
     
     def remove(self, component):
         self._children.remove(component)
+        component.removeGraphicalObjectListener(self._childListener)
+        self._boundingBox = None
 
     def selectionDistance(self, mousePoint: Point) -> float:
         rectangle = self.getBoundingBox()
-
-        #Check if mousePoint is inside object
-        rectangle_x_range = sorted([rectangle.getX(), rectangle.getX() + rectangle.getWidth()])
-        rectangle_y_range = sorted([rectangle.getY(), rectangle.getY() + rectangle.getHeight()])
-        if mousePoint.getX() >= rectangle_x_range[0] and mousePoint.getX() <= rectangle_x_range[1] and\
-           mousePoint.getY() >= rectangle_y_range[0] and mousePoint.getY() <= rectangle_y_range[1]:
-            return 0
-        
-        points = []
-        points.append(Point(rectangle.getX(), rectangle.getY()))
-        points.append(Point(rectangle.getX() + rectangle.getWidth(), rectangle.getY()))
-        points.append(Point(rectangle.getX(), rectangle.getY() + rectangle.getHeight()))
-        points.append(Point(rectangle.getX() + rectangle.getWidth(), rectangle.getY() + rectangle.getHeight()))
-        line_segments = [(points[0], points[1]),(points[0], points[2]),
-                         (points[1], points[3]), (points[2], points[3])]
-        return min([GeometryUtil.distanceFromLineSegment(ls[0], ls[1], mousePoint) for ls in line_segments])
+        if rectangle is None:
+            return math.inf
+        return GeometryUtil.distanceFromRectangle(rectangle.getX(), rectangle.getY(), rectangle.getWidth(),
+                                                  rectangle.getHeight(), mousePoint.getX(), mousePoint.getY())
 
     def getBoundingBox(self) -> Rectangle:
-        min_x = None
-        max_x = None
-        min_y = None
-        max_y = None
-        for child in self._children:
-            rectangle = child.getBoundingBox()
-            points = []
-            points.append([rectangle.getX(), rectangle.getY()])
-            points.append([rectangle.getX() + rectangle.getWidth(), rectangle.getY()])
-            points.append([rectangle.getX(), rectangle.getY() + rectangle.getHeight()])
-            points.append([rectangle.getX() + rectangle.getWidth(), rectangle.getY() + rectangle.getHeight()])
-            sorted_x = sorted(points, key= lambda x: x[0])
-            if min_x is None or sorted_x[0][0] < min_x:
-                min_x = sorted_x[0][0]
-            if max_x is None or sorted_x[-1][0] > max_x:
-                max_x = sorted_x[-1][0]
-            sorted_y = sorted(points, key= lambda x: x[1])
-            if min_y is None or sorted_y[0][1] < min_y:
-                min_y = sorted_y[0][1]
-            if max_y is None or sorted_y[-1][1] > max_y:
-                max_y = sorted_y[-1][1]
-        return Rectangle(min_x, min_y, max_x - min_x, max_y - min_y)
+        if self._boundingBox is None:
+            min_x = None
+            max_x = None
+            min_y = None
+            max_y = None
+            for child in self._children:
+                rectangle = child.getBoundingBox()
+                if rectangle is None:
+                    continue
+                x1, x2 = rectangle.getX(), rectangle.getX() + rectangle.getWidth()
+                y1, y2 = rectangle.getY(), rectangle.getY() + rectangle.getHeight()
+                if x1 > x2:
+                    x1, x2 = x2, x1
+                if y1 > y2:
+                    y1, y2 = y2, y1
+                if min_x is None or x1 < min_x:
+                    min_x = x1
+                if max_x is None or x2 > max_x:
+                    max_x = x2
+                if min_y is None or y1 < min_y:
+                    min_y = y1
+                if max_y is None or y2 > max_y:
+                    max_y = y2
+            #A composite without shapes in it has no bounding box
+            if min_x is None:
+                return None
+            self._boundingBox = Rectangle(min_x, min_y, max_x - min_x, max_y - min_y)
+        return self._boundingBox
 
     def duplicate(self):
         return Composite(self._children)
@@ -887,12 +1167,13 @@ class CompositeState(State):
         self._composite = composite
 
     def onEnter(self):
-        for selected_object in self._model.getSelectedObjects():
-            self._composite.add(selected_object)
-            selected_object.setSelected(False)
-            self._model.removeGraphicalObject(selected_object)
-        self._model.addGraphicalObject(self._composite)
-        self._composite.setSelected(True)
+        with self._model.batch():
+            for selected_object in self._model.getSelectedObjects():
+                self._composite.add(selected_object)
+                selected_object.setSelected(False)
+                self._model.removeGraphicalObject(selected_object)
+            self._model.addGraphicalObject(self._composite)
+            self._composite.setSelected(True)
         
     def mouseDown(self, mousePoint: Point, shiftDown: bool, ctrlDown: bool):
         pass
@@ -910,7 +1191,6 @@ class CompositeState(State):
             for hotpoint in range(child.getNumberOfHotpoints()):
                 new_hotpoint = child.getHotPoint(hotpoint).translate(hot_point_translate)
                 child.setHotPoint(hotpoint, new_hotpoint)
-        self._model.notifyListeners()
 
     def keyPressed(self, keyChar: str):
         if keyChar in ['Up', 'Down', 'Left', 'Right']:
@@ -922,31 +1202,35 @@ class CompositeState(State):
                 hot_point_translate = Point(-1, 0)
             elif keyChar == 'Right':
                 hot_point_translate = Point(1, 0)
-            for selected_object in self._model.getSelectedObjects():
-                if isinstance(selected_object, Composite):
-                    self._move_composite(selected_object, hot_point_translate)
-                else:
-                    for hotpoint in range(selected_object.getNumberOfHotpoints()):
-                        new_hotpoint = selected_object.getHotPoint(hotpoint).translate(hot_point_translate)
-                        selected_object.setHotPoint(hotpoint, new_hotpoint)
+            with self._model.batch():
+                for selected_object in self._model.getSelectedObjects():
+                    if isinstance(selected_object, Composite):
+                        self._move_composite(selected_object, hot_point_translate)
+                    else:
+                        for hotpoint in range(selected_object.getNumberOfHotpoints()):
+                            new_hotpoint = selected_object.getHotPoint(hotpoint).translate(hot_point_translate)
+                            selected_object.setHotPoint(hotpoint, new_hotpoint)
         elif keyChar == 'KP_Add':
-            for selected_object in self._model.getSelectedObjects():
-                self._model.increaseZ(selected_object)
+            with self._model.batch():
+                for selected_object in self._model.getSelectedObjects():
+                    self._model.increaseZ(selected_object)
         elif keyChar == 'KP_Subtract':
-            for selected_object in self._model.getSelectedObjects():
-                self._model.decreaseZ(selected_object)
+            with self._model.batch():
+                for selected_object in self._model.getSelectedObjects():
+                    self._model.decreaseZ(selected_object)
         elif keyChar == 'g':
             self._context.transition_to(CompositeState(self._model, Composite(self._model.getSelectedObjects())))
         elif keyChar == 'u':
             if len(self._model.getSelectedObjects()) == 1 and isinstance(self._model.getSelectedObjects()[0], Composite):
-                for child in self._composite.getChildren():
-                    self._model.addGraphicalObject(child)
-                    child.setSelected(True)
-                self._model.removeGraphicalObject(self._composite)
+                with self._model.batch():
+                    for child in self._composite.getChildren():
+                        self._model.addGraphicalObject(child)
+                        child.setSelected(True)
+                    self._model.removeGraphicalObject(self._composite)
                 self._context.transition_to(SelectShapeState(self._model))
 
     def afterDraw(self, r: Renderer, go: GraphicalObject = None):
-        if go is not None and go in self._model.getSelectedObjects():
+        if go is not None and go in self._model.getSelectedObjects() and go.getBoundingBox() is not None:
             rectangle = go.getBoundingBox()
             points = []
             points.append(Point(rectangle.getX(), rectangle.getY()))
@@ -979,8 +1263,9 @@ class EraserState(State):
         self._delete = set()
 
     def mouseUp(self, mousePoint: Point, shiftDown: bool, ctrlDown: bool):
-        for o in self._delete:
-            self._model.removeGraphicalObject(o)
+        with self._model.batch():
+            for o in self._delete:
+                self._model.removeGraphicalObject(o)
 
     def mouseDragged(self, mousePoint: Point):
         new_line = LineSegment(self._last_point, mousePoint)
@@ -1008,15 +1293,20 @@ class CanvasRendererImpl(Renderer):
     def __init__(self, canvas, context):
         self._canvas = canvas
         self._context = context
+        self._items = []
+
+    def takeItems(self) -> list:
+        items, self._items = self._items, []
+        return items
 
     def drawLine(self, s: Point, e: Point) -> None:
-        self._canvas.create_line([s.getX(), s.getY(), e.getX(), e.getY()], fill='blue')
+        self._items.append(self._canvas.create_line([s.getX(), s.getY(), e.getX(), e.getY()], fill='blue'))
 
     def fillPolygon(self, points) -> None:
         draw_points = []
         for point in points:
             draw_points.extend([point.getX(), point.getY()])
-        self._canvas.create_polygon(draw_points, outline='red', fill='blue')
+        self._items.append(self._canvas.create_polygon(draw_points, outline='red', fill='blue'))
 
 
 class SVGRendererImpl(Renderer):
@@ -1026,6 +1316,10 @@ class SVGRendererImpl(Renderer):
         self._fileName = fileName
         self._lines = ['<svg xmlns="http://www.w3.org/2000/svg"\nxmlns:xlink="http://www.w3.org/1999/xlink">']
 
+    def getTessellationTolerance(self) -> float:
+        #SVG output can be zoomed, so keep it finer than on screen
+        return 0.05
+
     def close(self):
         self._lines.append('</svg>')
         with open(self._fileName, 'w') as out:
@@ -1042,6 +1336,250 @@ class SVGRendererImpl(Renderer):
         self._lines.append(line)
 
 
+class StreamingSVGRendererImpl(Renderer):
+
+    _MAX_PATH_SEGMENTS = 1000
+
+    def __init__(self, fileName, compress: bool = None):
+        if compress is None:
+            compress = fileName.lower().endswith('.svgz')
+        if compress:
+            self._out = io.TextIOWrapper(gzip.open(fileName, 'wb'), encoding='utf-8')
+        else:
+            self._out = open(fileName, 'w', buffering=1 << 16)
+        self._path = []
+        self._pathEnd = None
+        try:
+            self._out.write('<svg xmlns="http://www.w3.org/2000/svg"\nxmlns:xlink="http://www.w3.org/1999/xlink">\n')
+        except BaseException:
+            self._out.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        #The file is closed even when rendering fails, the document is only finished on success
+        if exc_type is None:
+            self.close()
+        else:
+            self._out.close()
+
+    def getTessellationTolerance(self) -> float:
+        #SVG output can be zoomed, so keep it finer than on screen
+        return 0.05
+
+    def _flushPath(self) -> None:
+        if self._path:
+            self._out.write('<path d="{}" fill="none" stroke="blue"/>\n'.format(' '.join(self._path)))
+            self._path = []
+            self._pathEnd = None
+
+    def close(self):
+        try:
+            self._flushPath()
+            self._out.write('</svg>')
+        finally:
+            self._out.close()
+
+    def drawLine(self, s: Point, e: Point) -> None:
+        #Consecutive lines are merged into one path, continuing it when they connect
+        if len(self._path) >= self._MAX_PATH_SEGMENTS:
+            self._flushPath()
+        start = (s.getX(), s.getY())
+        if start != self._pathEnd:
+            self._path.append('M{} {}'.format(*start))
+        self._path.append('L{} {}'.format(e.getX(), e.getY()))
+        self._pathEnd = (e.getX(), e.getY())
+
+    def fillPolygon(self, points: list) -> None:
+        self._flushPath()
+        self._out.write('<polygon points="')
+        self._out.write(' '.join([str(point.getX()) + ',' + str(point.getY()) for point in points]))
+        self._out.write('" style="stroke:red; fill:blue;"/>\n')
+
+
+class DrawingFormat:
+
+    _SHAPES = {'@LINE': LineSegment, '@OVAL': Oval, '@COMP': Composite}
+
+    @staticmethod
+    def records(objects) -> list:
+        records = []
+        for o in objects:
+            DrawingFormat._addRecords(o, records)
+        return records
+
+    @staticmethod
+    def _addRecords(go, records) -> None:
+        #Children are written before their composite, which only stores how many to pop
+        if isinstance(go, Composite):
+            for child in go.getChildren():
+                DrawingFormat._addRecords(child, records)
+            records.append((go.getShapeID(), [len(go.getChildren())]))
+        else:
+            records.append((go.getShapeID(), list(go.getHotPointCoords())))
+
+    @staticmethod
+    def build(records) -> list:
+        stack = Stack()
+        for shape_id, data in records:
+            DrawingFormat._SHAPES[shape_id].load(stack, data)
+        objects = []
+        while not stack.empty():
+            objects.append(stack.pop())
+        return objects
+
+    @staticmethod
+    def formatFor(fileName):
+        if os.path.splitext(fileName)[1].lower() == BinaryDrawingFormat.EXTENSION:
+            return BinaryDrawingFormat
+        return TextDrawingFormat
+
+    @staticmethod
+    def load(fileName) -> list:
+        return DrawingFormat.formatFor(fileName).load(fileName)
+
+    @staticmethod
+    def save(fileName, objects) -> None:
+        DrawingFormat.formatFor(fileName).save(fileName, objects)
+
+    @staticmethod
+    def convert(source, destination) -> None:
+        DrawingFormat.save(destination, DrawingFormat.load(source))
+
+
+class TextDrawingFormat:
+
+    EXTENSION = '.txt'
+
+    @staticmethod
+    def load(fileName) -> list:
+        return DrawingFormat.build(TextDrawingFormat.read(fileName))
+
+    @staticmethod
+    def save(fileName, objects) -> None:
+        TextDrawingFormat.write(fileName, DrawingFormat.records(objects))
+
+    @staticmethod
+    def read(fileName) -> list:
+        records = []
+        with open(fileName, 'r') as inp:
+            for line in inp:
+                line = line.strip().split(' ')
+                if line[0] in DrawingFormat._SHAPES:
+                    records.append((line[0], line[1:]))
+        return records
+
+    @staticmethod
+    def write(fileName, records) -> None:
+        with open(fileName, 'w') as out:
+            out.write('\n'.join(' '.join([shape_id] + [str(value) for value in data]) for shape_id, data in records))
+
+
+class BinaryDrawingFormat:
+
+    #Header, then one column per field, all little-endian:
+    #  shape types        record count bytes, padded to a multiple of 8
+    #  child ranges       first child record and child count per record, non-zero only for composites
+    #  coordinates        four doubles per record, zero for composites
+    #Records are stored breadth first, top level objects first, so the children of every composite
+    #are one contiguous range of records after it
+    EXTENSION = '.paint'
+    MAGIC = b'PNTB'
+    VERSION = 2
+    #magic, version, record count, top level object count
+    _HEADER = struct.Struct('<4sH2xII')
+    _TYPES = {LineSegment: 1, Oval: 2, Composite: 3}
+    _SHAPES = {value: key for key, value in _TYPES.items()}
+    _COMPOSITE = 3
+    _RANGE_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+    @staticmethod
+    def _offsets(count) -> tuple:
+        ranges = BinaryDrawingFormat._HEADER.size + (count + 7) // 8 * 8
+        coords = ranges + 8 * count
+        return ranges, coords, coords + 32 * count
+
+    @staticmethod
+    def _littleEndian(values: array) -> bytes:
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        return values.tobytes()
+
+    @staticmethod
+    def save(fileName, objects) -> None:
+        records = list(objects)
+        types = array('B')
+        ranges = array(BinaryDrawingFormat._RANGE_TYPECODE)
+        coords = array('d')
+        for go in records:
+            if isinstance(go, Composite):
+                ranges.extend((len(records), len(go.getChildren())))
+                records.extend(go.getChildren())
+                coords.extend((0.0, 0.0, 0.0, 0.0))
+            else:
+                ranges.extend((0, 0))
+                coords.extend(go.getHotPointCoords())
+            types.append(BinaryDrawingFormat._TYPES[type(go)])
+        with open(fileName, 'wb') as out:
+            out.write(BinaryDrawingFormat._HEADER.pack(BinaryDrawingFormat.MAGIC, BinaryDrawingFormat.VERSION,
+                                                       len(records), len(objects)))
+            out.write(types.tobytes())
+            out.write(bytes(-len(types) % 8))
+            out.write(BinaryDrawingFormat._littleEndian(ranges))
+            out.write(BinaryDrawingFormat._littleEndian(coords))
+
+    @staticmethod
+    def load(fileName) -> list:
+        header = BinaryDrawingFormat._HEADER
+        with open(fileName, 'rb') as inp:
+            size = os.fstat(inp.fileno()).st_size
+            #An empty file is an empty drawing
+            if size == 0:
+                return []
+            if size < header.size:
+                raise ValueError('{} is not a binary drawing file'.format(fileName))
+            with mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, count, top = header.unpack_from(mm)
+                if magic != BinaryDrawingFormat.MAGIC:
+                    raise ValueError('{} is not a binary drawing file'.format(fileName))
+                if version != BinaryDrawingFormat.VERSION:
+                    raise ValueError('Unsupported binary drawing version {}'.format(version))
+                ranges_offset, coords_offset, end = BinaryDrawingFormat._offsets(count)
+                if len(mm) < end or top > count:
+                    raise ValueError('{} is truncated'.format(fileName))
+                types = array('B')
+                ranges = array(BinaryDrawingFormat._RANGE_TYPECODE)
+                coords = array('d')
+                with memoryview(mm) as view:
+                    types.frombytes(view[header.size:header.size + count])
+                    ranges.frombytes(view[ranges_offset:coords_offset])
+                    coords.frombytes(view[coords_offset:end])
+        if sys.byteorder == 'big':
+            ranges.byteswap()
+            coords.byteswap()
+        return BinaryDrawingFormat._build(fileName, types, ranges, coords, top)
+
+    @staticmethod
+    def _build(fileName, types, ranges, coords, top) -> list:
+        #Children always come after their composite, so building back to front finds them ready
+        objects = [None] * len(types)
+        for i in range(len(types) - 1, -1, -1):
+            shape = BinaryDrawingFormat._SHAPES.get(types[i])
+            if shape is None:
+                raise ValueError('{} has an unknown shape type {}'.format(fileName, types[i]))
+            if types[i] == BinaryDrawingFormat._COMPOSITE:
+                first, count = ranges[2 * i], ranges[2 * i + 1]
+                if first <= i or first + count > len(types):
+                    raise ValueError('{} has a broken composite at record {}'.format(fileName, i))
+                objects[i] = Composite(objects[first:first + count])
+            else:
+                objects[i] = shape.fromCoords(coords[4 * i:4 * i + 4])
+        return objects[:top]
+
+
 class GUI(DocumentModelListener):
 
     _objects: list
@@ -1049,9 +1587,13 @@ class GUI(DocumentModelListener):
     _renderer: CanvasRendererImpl
     _document_model: DocumentModel
     _context: Context
+    _canvasItems: dict
+    _overlayItems: list
 
     def __init__(self, objects):
         self._objects = objects
+        self._canvasItems = {}
+        self._overlayItems = []
         self._window = tk.Tk()
         self._document_model = DocumentModel()
         self._document_model.addDocumentModelListener(self)
@@ -1094,53 +1636,68 @@ class GUI(DocumentModelListener):
 
 
     def _svg_export(self):
-        f = tkinter.filedialog.asksaveasfilename(filetypes=[('Scalable Vector Graphics','*.svg')])
-        if f is not None:
-            renderer = SVGRendererImpl(f)
-            for o in self._document_model.list():
-                o.render(renderer)
-            renderer.close()
+        f = tkinter.filedialog.asksaveasfilename(filetypes=[('Scalable Vector Graphics','*.svg'), ('Compressed SVG', '*.svgz')])
+        if f:
+            with StreamingSVGRendererImpl(f) as renderer:
+                for o in self._document_model.list():
+                    o.render(renderer)
     
     def _save(self):
-        f = tkinter.filedialog.asksaveasfilename(filetypes=[('Text file','*.txt')])
-        if f is not None:
-            rows = []
-            for o in self._document_model.list():
-                o.save(rows)
-            with open(f, 'w') as out:
-                out.write('\n'.join(rows))
+        f = tkinter.filedialog.asksaveasfilename(filetypes=[('Text file','*.txt'), ('Binary drawing', '*' + BinaryDrawingFormat.EXTENSION)])
+        if f:
+            DrawingFormat.save(f, self._document_model.list())
 
     
     def _load(self):
-        ftypes = [('Text files', '*.txt'), ('All files', '*')]
+        ftypes = [('Text files', '*.txt'), ('Binary drawings', '*' + BinaryDrawingFormat.EXTENSION), ('All files', '*')]
         dlg = tk.filedialog.Open(filetypes = ftypes)
         fl = dlg.show()
 
         if fl != '':
-            lineStack = Stack()
-            with open(fl, 'r') as inp:
-                for line in inp:
-                    line = line.strip().split(' ')
-                    if line[0] == '@LINE':
-                        LineSegment.load(lineStack, line[1:])
-                    if line[0] == '@OVAL':
-                        Oval.load(lineStack, line[1:])
-                    if line[0] == '@COMP':
-                        Composite.load(lineStack, line[1:])
-        
-        while not lineStack.empty():
-            go = lineStack.pop()
-            self._document_model.addGraphicalObject(go)
+            with self._document_model.batch():
+                for go in DrawingFormat.load(fl):
+                    self._document_model.addGraphicalObject(go)
         
-    def documentChange(self) -> None:
-        self.canvas.delete("all")
-        for graphical_object in self._document_model.list():
-            graphical_object.render(self._renderer)
-            self._context.afterDraw(self._renderer, graphical_object)
+    def documentChange(self, changed: set = None) -> None:
+        #Items drawn outside of document rendering (e.g. eraser trail) live until the next change
+        self.canvas.delete(*self._renderer.takeItems(), *self._overlayItems)
+        if changed is None:
+            self.canvas.delete("all")
+            self._canvasItems = {}
+            for graphical_object in self._document_model.list():
+                self._canvasItems[graphical_object] = self._renderObject(graphical_object)
+        else:
+            #Top down, so the object above each redrawn one is already on the canvas
+            for graphical_object in sorted(changed, key=self._document_model.getZ, reverse=True):
+                self._redrawObject(graphical_object)
         self._context.afterDraw(self._renderer)
+        self._overlayItems = self._renderer.takeItems()
+
+    def _renderObject(self, graphical_object: GraphicalObject) -> list:
+        graphical_object.render(self._renderer)
+        self._context.afterDraw(self._renderer, graphical_object)
+        return self._renderer.takeItems()
+
+    def _redrawObject(self, graphical_object: GraphicalObject) -> None:
+        self.canvas.delete(*self._canvasItems.pop(graphical_object, []))
+        if self._document_model.getZ(graphical_object) < 0:
+            return
+        items = self._renderObject(graphical_object)
+        self._canvasItems[graphical_object] = items
+        #Keep z-order by stacking new items right below the next object that is on the canvas
+        above = self._document_model.objectAbove(graphical_object)
+        while above is not None and not self._canvasItems.get(above):
+            above = self._document_model.objectAbove(above)
+        if above is not None:
+            for item in items:
+                self.canvas.tag_lower(item, self._canvasItems[above][0])
 
 
 def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--convert':
+        DrawingFormat.convert(sys.argv[2], sys.argv[3])
+        return
+
     objects = []
     objects.append(LineSegment())
     objects.append(Oval())
@@ -0,0 +1,261 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from paint import (np, Point, LineSegment, Oval, Composite, SelectionDistanceBatch, DocumentModel, Context,
+                   IdleState, SelectShapeState, EraserState, DrawingFormat, BinaryDrawingFormat, GUI,
+                   CanvasRendererImpl)
+
+
+class StubCanvas:
+
+    #Just the part of tk.Canvas that GUI draws with, items are only counted
+
+    def __init__(self):
+        self._items = set()
+        self._nextItem = 0
+        self.lines = 0
+        self.polygons = 0
+
+    def _create(self):
+        self._nextItem += 1
+        self._items.add(self._nextItem)
+        return self._nextItem
+
+    def create_line(self, coords, **options):
+        self.lines += 1
+        return self._create()
+
+    def create_polygon(self, coords, **options):
+        self.polygons += 1
+        return self._create()
+
+    def delete(self, *items):
+        for item in items:
+            if item == "all":
+                self._items.clear()
+            else:
+                self._items.discard(item)
+
+    def tag_lower(self, item, belowThis):
+        pass
+
+
+class HeadlessGUI(GUI):
+
+    #The real GUI.documentChange drawing onto a StubCanvas instead of a Tk window. fullRedraw is
+    #what GUI used to do on every change, kept on a separate canvas to compare against
+
+    def __init__(self, model, context, recorder):
+        self._objects = []
+        self._canvasItems = {}
+        self._overlayItems = []
+        self._document_model = model
+        self._context = context
+        self.canvas = StubCanvas()
+        self._renderer = CanvasRendererImpl(self.canvas, context)
+        self._fullCanvas = StubCanvas()
+        self._fullRenderer = CanvasRendererImpl(self._fullCanvas, context)
+        self._recorder = recorder
+        self.redraws = 0
+
+    def documentChange(self, changed: set = None) -> None:
+        self.redraws += 1
+        operation = 'documentChange (all)' if changed is None else 'documentChange (changed)'
+        self._recorder.measure(operation, super().documentChange, changed)
+
+    def fullRedraw(self) -> None:
+        self._fullCanvas.delete("all")
+        for graphical_object in self._document_model.list():
+            graphical_object.render(self._fullRenderer)
+            self._context.afterDraw(self._fullRenderer, graphical_object)
+        self._context.afterDraw(self._fullRenderer)
+        self._fullRenderer.takeItems()
+
+
+class LatencyRecorder:
+
+    def __init__(self):
+        self._samples = {}
+
+    def measure(self, operation, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self._samples.setdefault(operation, []).append(time.perf_counter() - start)
+        return result
+
+    @staticmethod
+    def _percentile(ordered, fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def report(self, title):
+        print(title)
+        print('{:<28} {:>7} {:>10} {:>10} {:>10} {:>10}'.format('operation', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+        for operation, samples in self._samples.items():
+            ordered = sorted(samples)
+            print('{:<28} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                operation, len(ordered), self._percentile(ordered, 0.5) * 1000, self._percentile(ordered, 0.9) * 1000,
+                self._percentile(ordered, 0.99) * 1000, ordered[-1] * 1000))
+        print()
+
+
+def random_shape(rng, width, height):
+    x, y = rng.uniform(0, width), rng.uniform(0, height)
+    if rng.random() < 0.5:
+        return LineSegment(Point(x, y), Point(x + rng.uniform(-50, 50), y + rng.uniform(-50, 50)))
+    else:
+        return Oval(Point(x + rng.uniform(5, 40), y), Point(x, y + rng.uniform(5, 40)))
+
+
+def random_composite(rng, width, height, depth):
+    children = [random_shape(rng, width, height) for _ in range(rng.randint(2, 4))]
+    if depth > 1:
+        children.append(random_composite(rng, width, height, depth - 1))
+    return Composite(children)
+
+
+def generate_shapes(count, width=4000, height=4000, seed=0, composite_ratio=0.05, composite_depth=3):
+    rng = random.Random(seed)
+    shapes = []
+    while len(shapes) < count:
+        if rng.random() < composite_ratio:
+            shapes.append(random_composite(rng, width, height, rng.randint(1, composite_depth)))
+        else:
+            shapes.append(random_shape(rng, width, height))
+    return shapes
+
+
+def best_of(function, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark_selection_distance(sizes=(1000, 10000, 100000), repeats=5):
+    print('Selection distance, one mouse point against all shapes ({})'
+          .format('numpy' if np is not None else 'numpy not installed, batch falls back to scalar loop'))
+    print('{:>8} {:>12} {:>12} {:>8}'.format('shapes', 'scalar ms', 'batch ms', 'speedup'))
+    for size in sizes:
+        shapes = generate_shapes(size)
+        batch = SelectionDistanceBatch()
+        for shape in shapes:
+            batch.insert(shape)
+        mousePoint = Point(2000, 2000)
+
+        scalar = [shape.selectionDistance(mousePoint) for shape in shapes]
+        vectorized = batch.distances(mousePoint)
+        assert all(abs(a - b) < 1e-9 for a, b in zip(scalar, vectorized))
+
+        scalar_time = best_of(lambda: [shape.selectionDistance(mousePoint) for shape in shapes], repeats)
+        batch_time = best_of(lambda: batch.distances(mousePoint), repeats)
+        print('{:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(size, scalar_time * 1000, batch_time * 1000, scalar_time / batch_time))
+    print()
+
+
+def shape_signature(go):
+    #The text format reverses composite children, so they are compared as a sorted list
+    if isinstance(go, Composite):
+        return ('@COMP', sorted(repr(shape_signature(child)) for child in go.getChildren()))
+    return (go.getShapeID(), tuple(go.getHotPointCoords()))
+
+
+def check_drawing_formats(size=1000):
+    shapes = generate_shapes(size, composite_ratio=0.2)
+    with tempfile.TemporaryDirectory() as directory:
+        binary = os.path.join(directory, 'drawing' + BinaryDrawingFormat.EXTENSION)
+        text = os.path.join(directory, 'drawing.txt')
+        converted = os.path.join(directory, 'converted' + BinaryDrawingFormat.EXTENSION)
+        DrawingFormat.save(binary, shapes)
+        assert [shape_signature(go) for go in DrawingFormat.load(binary)] == [shape_signature(go) for go in shapes]
+        DrawingFormat.convert(binary, text)
+        DrawingFormat.convert(text, converted)
+        assert ([shape_signature(go) for go in DrawingFormat.load(converted)] ==
+                [shape_signature(go) for go in DrawingFormat.load(text)])
+
+        empty = os.path.join(directory, 'empty' + BinaryDrawingFormat.EXTENSION)
+        open(empty, 'wb').close()
+        assert DrawingFormat.load(empty) == []
+        DrawingFormat.save(empty, [])
+        assert DrawingFormat.load(empty) == []
+    print('Drawing formats: binary, text and converted files load the same {} shapes, empty .paint files load'
+          .format(size))
+    print()
+
+
+def replay_session(size, events, seed=0, width=4000, height=4000):
+    rng = random.Random(seed)
+    recorder = LatencyRecorder()
+    model = DocumentModel()
+    context = Context(IdleState())
+    gui = HeadlessGUI(model, context, recorder)
+
+    for shape in generate_shapes(size, width, height, seed):
+        model.addGraphicalObject(shape)
+    model.addDocumentModelListener(gui)
+
+    gui.documentChange()
+    for _ in range(events):
+        mousePoint = Point(rng.uniform(0, width), rng.uniform(0, height))
+        recorder.measure('findSelectedGraphicalObject', model.findSelectedGraphicalObject, mousePoint)
+
+    context.transition_to(SelectShapeState(model))
+    for _ in range(events):
+        mousePoint = Point(rng.uniform(0, width), rng.uniform(0, height))
+        recorder.measure('mouseDown (select)', context.mouseDown, mousePoint, False, False)
+        if model.getSelectedObjects():
+            selected_object = model.getSelectedObjects()[0]
+            if selected_object.getNumberOfHotpoints():
+                hotpoint = selected_object.getHotPoint(0)
+                recorder.measure('mouseDown (hotpoint)', context.mouseDown, hotpoint, False, False)
+                for step in range(5):
+                    recorder.measure('mouseDragged (hotpoint)', context.mouseDragged,
+                                     Point(hotpoint.getX() + step, hotpoint.getY() + step))
+            recorder.measure('keyPressed (arrow)', context.keyPressed, rng.choice(['Up', 'Down', 'Left', 'Right']))
+
+    context.transition_to(EraserState(model, gui._renderer))
+    for _ in range(max(1, events // 10)):
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        recorder.measure('mouseDown (eraser)', context.mouseDown, Point(x, y), False, False)
+        for step in range(20):
+            recorder.measure('mouseDragged (eraser)', context.mouseDragged, Point(x + 3 * step, y + 2 * step))
+        recorder.measure('mouseUp (eraser)', context.mouseUp, Point(x + 60, y + 40), False, False)
+
+    for _ in range(10):
+        recorder.measure('full redraw (old)', gui.fullRedraw)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in ('.txt', '.paint'):
+            fileName = os.path.join(directory, 'drawing' + extension)
+            recorder.measure('save ({})'.format(extension), DrawingFormat.save, fileName, model.list())
+            for _ in range(3):
+                recorder.measure('_load ({})'.format(extension), DrawingFormat.load, fileName)
+
+    recorder.report('Scripted session, {} shapes, {} redraws, {} lines / {} polygons drawn by GUI.documentChange'
+                    .format(size, gui.redraws, gui.canvas.lines, gui.canvas.polygons))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless benchmarks for paint.py')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--skip-selection', action='store_true')
+    parser.add_argument('--skip-session', action='store_true')
+    args = parser.parse_args()
+
+    check_drawing_formats()
+    if not args.skip_selection:
+        benchmark_selection_distance(args.sizes)
+    if not args.skip_session:
+        for size in args.sizes:
+            replay_session(size, args.events)
+
+
+if __name__ == "__main__":
+    main()